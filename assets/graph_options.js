@@ -0,0 +1,101 @@
+// Applies the x axis, overlay and download format switches to graphs
+// already in the browser, so they don't have to be rebuilt and sent again.
+//
+// Analytic traces carry meta.minutes_per_ml, their inverse flow rate, so
+// their x values can move between mL and Time. The figure's layout.meta
+// says which of the two its x values are in.
+
+(function () {
+    const X_TITLES = {mL: "mL", Time: "Time (min)"};
+
+    function values(array) {
+        if (!array || Array.isArray(array) || ArrayBuffer.isView(array)) {
+            return array;
+        }
+
+        // plotly's base64 typed array form
+        const bytes = Uint8Array.from(atob(array.bdata), (c) => c.charCodeAt(0));
+        return new {f8: Float64Array, f4: Float32Array}[array.dtype](bytes.buffer);
+    }
+
+    function isPreparative(trace) {
+        return String(trace.name).startsWith("Preparative: ");
+    }
+
+    function moveTrace(trace, from, to) {
+        const minutesPerMl = trace.meta && trace.meta.minutes_per_ml;
+        if (!Number.isFinite(minutesPerMl) || minutesPerMl === 0) {
+            return trace;
+        }
+
+        const scale = to === "Time" ? minutesPerMl : 1 / minutesPerMl;
+        return Object.assign({}, trace, {
+            x: Array.from(values(trace.x), (x) => x * scale),
+            hovertemplate: trace.hovertemplate
+                ? trace.hovertemplate.replace(`<br>${from}=%{x}`, `<br>${to}=%{x}`)
+                : trace.hovertemplate,
+        });
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside);
+    window.dash_clientside.appia = Object.assign({}, window.dash_clientside.appia, {
+        // the overlay is always drawn against mL, and its traces are added
+        // by the server (web.add_overlay), so here they are only removed
+        setXAxis: function (xAxis, overlay, figure) {
+            if (!figure) {
+                return window.dash_clientside.no_update;
+            }
+            const to = overlay && overlay.length ? "mL" : xAxis;
+            const from = (figure.layout.meta && figure.layout.meta.x_axis) || "mL";
+
+            let data = figure.data;
+            if (!(overlay && overlay.length)) {
+                data = data.filter((trace) => !isPreparative(trace));
+            }
+            if (from === to && data.length === figure.data.length) {
+                return window.dash_clientside.no_update;
+            }
+
+            const layout = Object.assign({}, figure.layout, {
+                meta: Object.assign({}, figure.layout.meta, {x_axis: to}),
+            });
+            if (from !== to) {
+                data = data.map((trace) => moveTrace(trace, from, to));
+                // the old range was in the other units
+                layout.xaxis = Object.assign({}, layout.xaxis, {
+                    autorange: true,
+                    title: {text: X_TITLES[to]},
+                });
+                delete layout.xaxis.range;
+            }
+
+            return Object.assign({}, figure, {data: data, layout: layout});
+        },
+
+        // svg downloads need svg traces rather than WebGL ones. Filled
+        // traces (the FPLC fractions) are always svg.
+        setRenderMode: function (format, figure) {
+            if (!figure) {
+                return window.dash_clientside.no_update;
+            }
+            const type = format === "svg" ? "scatter" : "scattergl";
+            const switched = (trace) => !trace.fill || trace.fill === "none";
+            if (figure.data.every((trace) => !switched(trace) || trace.type === type)) {
+                return window.dash_clientside.no_update;
+            }
+
+            return Object.assign({}, figure, {
+                data: figure.data.map((trace) =>
+                    switched(trace) ? Object.assign({}, trace, {type: type}) : trace
+                ),
+            });
+        },
+
+        setDownloadFormat: function (format, config) {
+            const options = Object.assign({}, config && config.toImageButtonOptions, {
+                format: format,
+            });
+            return Object.assign({}, config, {toImageButtonOptions: options});
+        },
+    });
+})();
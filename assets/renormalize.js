@@ -0,0 +1,72 @@
+// Renormalizes the Normalized HPLC graph in the browser, the same way
+// appia.processors.core.normalizer does on the server: each trace is
+// rescaled so its minimum is 0 and its maximum within the range is 1.
+//
+// Each analytic trace carries its raw signal and mL in customdata and
+// the minimum of the whole trace in meta.signal_min. Traces without
+// that (the preparative overlay) are left as they are.
+
+(function () {
+    // customdata arrives either as nested arrays or in plotly's base64
+    // typed array form, which plotly.js decodes but leaves in the figure
+    function customRows(custom) {
+        if (Array.isArray(custom)) {
+            return custom;
+        }
+
+        const bytes = Uint8Array.from(atob(custom.bdata), (c) => c.charCodeAt(0));
+        const values = new {f8: Float64Array, f4: Float32Array}[custom.dtype](
+            bytes.buffer
+        );
+        const width = custom.shape ? Number(custom.shape.split(",")[1]) : 1;
+        const rows = [];
+        for (let i = 0; i < values.length; i += width) {
+            rows.push(values.subarray(i, i + width));
+        }
+        return rows;
+    }
+
+    function renormalizeTrace(trace, low, high) {
+        if (!trace.meta || trace.meta.signal_min === undefined || !trace.customdata) {
+            return trace;
+        }
+
+        const rows = customRows(trace.customdata);
+        let max = -Infinity;
+        for (const [signal, mL] of rows) {
+            if (mL > low && mL < high && signal > max) {
+                max = signal;
+            }
+        }
+        // nothing of this trace in the range
+        if (max === -Infinity) {
+            return trace;
+        }
+
+        const min = trace.meta.signal_min;
+        const y = rows.map(([signal]) => {
+            const value = (signal - min) / (max - min);
+            return Number.isNaN(value) ? 0 : value;
+        });
+
+        return Object.assign({}, trace, {y: y});
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside);
+    window.dash_clientside.appia = Object.assign({}, window.dash_clientside.appia, {
+        renormalize: function (n_clicks, search, figure) {
+            const viewRange = new URLSearchParams(search).get("view-range");
+            if (!n_clicks || !figure || !viewRange) {
+                return window.dash_clientside.no_update;
+            }
+
+            const ends = viewRange.split("-").map(Number);
+            const low = Math.min(...ends);
+            const high = Math.max(...ends);
+
+            return Object.assign({}, figure, {
+                data: figure.data.map((trace) => renormalizeTrace(trace, low, high)),
+            });
+        },
+    });
+})();
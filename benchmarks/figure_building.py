@@ -0,0 +1,98 @@
+"""
+Times building the web viewer's HPLC figures with plotly express against
+building them with appia.plotters.trace_figure, on a synthetic experiment.
+
+    python benchmarks/figure_building.py --samples 60 --channels 4
+"""
+
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.utils
+from appia.plotters.trace_figure import facet_figure
+
+
+def synthetic_hplc(num_samples, num_channels, num_points, seed=0):
+    # one long table of traces, as get_hplc_graphs plots them
+    rng = np.random.default_rng(seed)
+    ml = np.linspace(0, 25, num_points)
+    tables = []
+    for sample in range(num_samples):
+        for channel in range(num_channels):
+            peak = np.exp(-((ml - rng.uniform(8, 16)) ** 2) / 0.5)
+            tables.append(
+                pd.DataFrame(
+                    {
+                        "mL": ml,
+                        "Sample": f"Sample {sample}",
+                        "Channel": f"Channel {channel}",
+                        "Value": rng.uniform(10, 1000) * peak
+                        + rng.normal(0, 1, num_points),
+                    }
+                )
+            )
+    return pd.concat(tables, ignore_index=True)
+
+
+def px_figure(df):
+    # the figure code get_hplc_graphs used before trace_figure
+    fig = px.line(
+        data_frame=df,
+        x="mL",
+        y="Value",
+        color="Sample",
+        facet_row="Channel",
+        template="plotly_white",
+        render_mode="auto",
+    )
+    fig.update_yaxes(matches=None)
+    fig.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
+    return fig
+
+
+def array_figure(df):
+    return facet_figure(df, "mL", "Value", "Sample", "Channel")
+
+
+def best_time(function, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--samples", type=int, default=60)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument(
+        "--points",
+        help="Points per trace. The viewer sends about 1000.",
+        type=int,
+        default=1000,
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    df = synthetic_hplc(args.samples, args.channels, args.points)
+    print(
+        f"{args.samples} samples x {args.channels} channels x {args.points} points "
+        f"({len(df)} rows)"
+    )
+
+    for name, build in [("px.line", px_figure), ("facet_figure", array_figure)]:
+        build_time, fig = best_time(lambda: build(df), args.repeats)
+        # dash serializes the figure for every response
+        json_time, _ = best_time(
+            lambda: json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder), args.repeats
+        )
+        print(f"{name:>14}: build {build_time:.3f} s, serialize {json_time:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
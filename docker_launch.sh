@@ -8,4 +8,7 @@ for i in $(seq 20); do
     sleep 1
 done
 
+# workers share decoded experiments and figures through this directory
+export APPIA_CACHE_DIR="${APPIA_CACHE_DIR:-/tmp/appia-cache}"
+
 gunicorn -w 5 -b :8080 web:server
\ No newline at end of file
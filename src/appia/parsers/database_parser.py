@@ -29,17 +29,18 @@ def main(args):
 
     if args.inspect:
         for id in args.inspect:
-            exp = db.pull_experiment(id)
+            exp = db.pull_experiment(id, args.level)
             print(exp)
             exp.show_tables()
 
     if args.download:
         for id in args.download:
-            exp = db.pull_experiment(id)
+            exp = db.pull_experiment(id, args.level)
             exp.save_csvs(os.getcwd())
 
     if args.migrate:
-        db.migrate()
+        # 0 means every core, which is also what the pool does with None
+        db.migrate(args.jobs or None)
 
 
 parser = argparse.ArgumentParser(description="Database management", add_help=False)
@@ -62,6 +63,11 @@ parser.add_argument(
     type=str,
     nargs="+",
 )
+parser.add_argument(
+    "--level",
+    help="Get HPLC data for --inspect and --download reduced to at least this many points per trace, if the experiment was uploaded with such a level. Default every point.",
+    type=int,
+)
 parser.add_argument(
     "--check-versions",
     help="List experiments, categorized by version.",
@@ -72,3 +78,10 @@ parser.add_argument(
     help="Download and upload all experiments to migrate them to a new version. Back up first!!!",
     action="store_true",
 )
+parser.add_argument(
+    "-j",
+    "--jobs",
+    help="Convert experiments in this many worker processes during --migrate. Give 0 to use every core. Default 0.",
+    type=int,
+    default=0,
+)
@@ -4,33 +4,71 @@ import sys
 import logging
 import shutil
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from appia.processors import hplc, fplc, experiment, core
+from appia.processors import experiment, core, decimate
+from appia.processors.registry import ProcessorRegistry
 from appia.plotters import auto_plot
 
 
-def main(args):
-    file_list = core.process_globs(args.files)
+def process_deferred(processor):
+    # runs in a worker process, so must not prompt the user
+    processor.process_file()
+    return processor
+
+
+def process_files(file_list, args):
     num_files = len(file_list)
-    hplc_processors = hplc.HplcProcessor.__subclasses__()
-    fplc_processors = fplc.FplcProcessor.__subclasses__()
-    processors = hplc_processors + fplc_processors
+    registry = ProcessorRegistry()
+    jobs = getattr(args, "jobs", None)
+    if jobs is None:
+        jobs = 1
+    elif jobs < 1:
+        jobs = os.cpu_count()
     processed_files = []
 
     for i, filename in enumerate(file_list):
         core.loading_bar(i + 1, num_files)
-        claimed = [Proc(filename, **vars(args)) for Proc in processors]
-        claimed = [x for x in claimed if x.claimed]
+        claimed = registry.claim(filename)
 
         if len(claimed) == 1:
-            processed_files.append(claimed[0])
+            Proc, reason = claimed[0]
+            processed_files.append(
+                Proc(
+                    filename,
+                    claim_reason=reason,
+                    defer_processing=jobs > 1,
+                    **vars(args),
+                )
+            )
         elif len(claimed) > 1:
-            logging.error(f"{filename} claimed by multiple processors. Skipping.")
+            logging.error(
+                f"{filename} claimed by multiple processors ({', '.join(x[0].__name__ for x in claimed)}). Skipping."
+            )
         else:
             logging.warning(
                 f"{filename} claimed by no processor. If it is not a chromatography trace, this is fine."
             )
 
+    if jobs > 1 and processed_files:
+        # every prompt has to be answered here, in file order, before the
+        # workers start. Otherwise they would all be waiting on stdin.
+        for processor in processed_files:
+            processor.resolve_user_input()
+
+        logging.info(f"Processing {len(processed_files)} files with {jobs} workers")
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            # map returns results in submission order, so the experiment
+            # is assembled exactly as it would be serially
+            processed_files = list(executor.map(process_deferred, processed_files))
+
+    return processed_files
+
+
+def main(args):
+    file_list = core.process_globs(args.files)
+    processed_files = process_files(file_list, args)
+
     # Make Experiment ------------------------------------------------------------
     if args.id:
         exp_id = args.id
@@ -47,18 +85,22 @@ def main(args):
     exp = experiment.Experiment(exp_id)
 
     try:
-        exp.hplc = pd.concat([x.df for x in processed_files if x.proc_type == "hplc"])
+        exp.hplc = pd.concat(
+            [x.compact for x in processed_files if x.proc_type == "hplc"]
+        )
     except ValueError:
         exp.hplc = None
     try:
-        exp.fplc = pd.concat([x.df for x in processed_files if x.proc_type == "fplc"])
+        exp.fplc = pd.concat(
+            [x.compact for x in processed_files if x.proc_type == "fplc"]
+        )
     except ValueError:
         exp.fplc = None
 
     logging.debug("Experiment HPLC data:")
-    logging.debug(exp.hplc)
+    logging.debug(exp.compact_hplc)
     logging.debug("Experiment FPLC data:")
-    logging.debug(exp.fplc)
+    logging.debug(exp.compact_fplc)
 
     try:
         logging.info(f"Made {exp}")
@@ -101,8 +143,8 @@ def main(args):
 
     # rescale and renormalize whole experiment ------------------------
 
-    if args.scale_hplc and exp.hplc is not None:
-        exp.hplc["Value"] = exp.hplc["Value"] * args.scale_hplc
+    if args.scale_hplc and exp.compact_hplc is not None:
+        exp.scale_hplc(args.scale_hplc)
 
     try:
         exp.renormalize_hplc(args.normalize, args.strict_normalize)
@@ -128,7 +170,7 @@ def main(args):
     )
 
     if args.plots:
-        if exp.hplc is not None:
+        if exp.compact_hplc is not None:
             logging.info("Making HPLC plots")
             auto_plot.auto_plot_hplc(exp.hplc, args.ml, "mL").write_image(
                 os.path.join(out_dir, f"{exp.id}_auto-plot-hplc.png"),
@@ -136,10 +178,13 @@ def main(args):
                 height=1080,
             )
 
-        if exp.fplc is not None:
+        if exp.compact_fplc is not None:
             logging.info("Making FPLC plot")
+            # the fraction marks are only needed for single-run plots
+            fplc_files = [x for x in processed_files if x.proc_type == "fplc"]
+            fraction_table = getattr(fplc_files[0], "fraction_table", None)
             auto_plot.auto_plot_fplc(
-                exp.fplc, args.ml, args.fractions, "mL"
+                exp.fplc, args.ml, args.fractions, "mL", fraction_table
             ).write_image(
                 os.path.join(out_dir, f"{exp.id}_auto-plot-fplc.png"),
                 width=1920,
@@ -149,12 +194,12 @@ def main(args):
     # copy the manual plotting script, if requested ----------------
 
     if args.copy_manual is not None:
-        if exp.hplc is not None:
+        if exp.compact_hplc is not None:
             shutil.copyfile(
                 os.path.join(script_location, args.copy_manual, "manual_plot_HPLC.R"),
                 os.path.join(out_dir, f"{exp.id}_manual-plot-HPLC.R"),
             )
-        if exp.fplc is not None:
+        if exp.compact_fplc is not None:
             shutil.copyfile(
                 os.path.join(script_location, args.copy_manual, "manual_plot_FPLC.R"),
                 os.path.join(out_dir, f"{exp.id}_manual-plot-FPLC.R"),
@@ -165,7 +210,13 @@ def main(args):
     if args.database:
         from appia.processors.database import db
 
-        exp.reduce_hplc(args.reduce)
+        # the levels are the overviews, so with them every point is kept
+        reduce = args.reduce
+        if reduce is None:
+            reduce = 0 if args.levels else 1000
+        if reduce:
+            exp.reduce_hplc(reduce, args.reduce_method)
+        exp.levels = args.levels
         db.upload_experiment(exp, args.overwrite)
 
     return exp
@@ -210,6 +261,13 @@ file_io.add_argument(
 )
 
 process_args = parser.add_argument_group("Processing Options")
+process_args.add_argument(
+    "-j",
+    "--jobs",
+    help="Parse files in this many worker processes. All prompts are answered before the workers start. Give 0 to use every core. Default 1.",
+    type=int,
+    default=1,
+)
 process_args.add_argument(
     "--hplc-flow-rate",
     help="Manually override flow rate. Provide a single number in mL/min",
@@ -261,9 +319,21 @@ web_up = parser.add_argument_group("Web Upload")
 web_up.add_argument(
     "-r",
     "--reduce",
-    help="Reduce web HPLC data points to this many total. Default 1000. CSV files are saved at full temporal resolution regardless.",
+    help="Reduce web HPLC data points to this many per trace. Give 0 to upload every point. Default 0 while --levels are stored, 1000 otherwise. CSV files are saved at full temporal resolution regardless.",
+    type=int,
+)
+web_up.add_argument(
+    "--reduce-method",
+    help="How to pick the points kept by --reduce. lttb (largest triangle three buckets) keeps the shape of the trace, minmax keeps the highest and lowest point in every bucket. Default lttb.",
+    choices=decimate.METHODS,
+    default="lttb",
+)
+web_up.add_argument(
+    "--levels",
+    help="Also upload the HPLC data reduced to each of these many points per trace, for quick overviews and zooming in. Levels with more points than the uploaded traces are skipped. Give no numbers to upload no levels, which reduces the upload to 1000 points per trace unless --reduce says otherwise. Default 500 5000 50000.",
     type=int,
-    default=1000,
+    nargs="*",
+    default=experiment.HPLC_LEVELS,
 )
 web_up.add_argument(
     "-d",
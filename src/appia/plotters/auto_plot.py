@@ -3,6 +3,8 @@ import plotly.graph_objects as go
 import logging
 import pandas as pd
 import os
+from appia.processors import fplc
+from appia.processors.decimate import decimate
 
 
 def limit_fixer(df_limits, input_limits):
@@ -24,8 +26,11 @@ def limit_fixer(df_limits, input_limits):
     return limits
 
 
-def auto_plot_hplc(df, limits, xax_var):
-    df = df[::10]
+def auto_plot_hplc(df, limits, xax_var, num_points=1000):
+    # plenty for a 1920 px image, and unlike every nth point keeps the peaks
+    df = decimate(
+        df, ["Sample", "Channel", "Normalization"], xax_var, "Value", num_points
+    )
     df_lims = [min(df[xax_var]), max(df[xax_var])]
     limits = limit_fixer(df_lims, limits)
 
@@ -46,7 +51,7 @@ def auto_plot_hplc(df, limits, xax_var):
     return fig
 
 
-def auto_plot_fplc(df, limits, fractions, xax_var):
+def auto_plot_fplc(df, limits, fractions, xax_var, fraction_table=None):
     df = df[df["Channel"] == "mAU"]
     df_lims = [min(df[xax_var]), max(df[xax_var])]
     df_fractions = [min(df["Fraction"]), max(df["Fraction"])]
@@ -68,13 +73,21 @@ def auto_plot_fplc(df, limits, fractions, xax_var):
 
     if len(samples) == 1:
         df = df[df["Normalization"] == "Signal"]
-        frac_df = df[(df["Fraction"].isin(fractions))]
+        if not df["mL"].is_monotonic_increasing:
+            df = df.sort_values("mL", kind="stable")
+        if fraction_table is None:
+            fraction_table = fplc.trace_fraction_table(df)
+        ml = df["mL"].to_numpy()
+        value = df["Value"].to_numpy()
+        frac_slices = fplc.fraction_slices(ml, fraction_table)
+
         fig = go.Figure()
         for frac in fractions:
+            frac_slice = frac_slices.get(frac, slice(0, 0))
             fig.add_trace(
                 go.Scatter(
-                    x=frac_df[frac_df.Fraction == frac]["mL"],
-                    y=frac_df[frac_df.Fraction == frac]["Value"],
+                    x=ml[frac_slice],
+                    y=value[frac_slice],
                     mode="lines",
                     fill="tozeroy",
                     # if you don't rename them, fraction numbering is off by one
@@ -0,0 +1,235 @@
+import base64
+import functools
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.io as pio
+
+# space between facet rows, and the share of the width left for their
+# labels, as plotly express lays them out
+ROW_SPACING = 0.03
+LABEL_MARGIN = 0.02
+
+
+@functools.lru_cache()
+def template_json(name="plotly_white"):
+    # dict figures skip plotly.py, so the template has to be spelled out
+    return pio.templates[name].to_plotly_json()
+
+
+def typed_array(values):
+    """
+    Float arrays in plotly.js's base64 typed array form, which plotly.py
+    also uses for validated figures and which is much quicker to send
+    than a list of numbers. Other arrays are returned as they are.
+    """
+    code = {"float64": "f8", "float32": "f4"}.get(str(values.dtype))
+    if code is None:
+        return values
+
+    data = np.ascontiguousarray(values, dtype=values.dtype.newbyteorder("<"))
+    typed = {"dtype": code, "bdata": base64.b64encode(data).decode("ascii")}
+    if values.ndim > 1:
+        typed["shape"] = ", ".join(str(x) for x in values.shape)
+
+    return typed
+
+
+def group_slices(df: pd.DataFrame, columns):
+    """
+    Row order grouping df by columns, each in order of first appearance,
+    with each group's values and its slice of that order. Rows keep their
+    order within a group.
+    """
+    codes = np.zeros(len(df), dtype=np.int64)
+    uniques = []
+    for column in columns:
+        column_codes, column_uniques = pd.factorize(df[column], sort=False)
+        codes = codes * len(column_uniques) + column_codes
+        uniques.append(column_uniques)
+
+    order = np.argsort(codes, kind="stable")
+    group_codes, starts = np.unique(codes[order], return_index=True)
+    stops = np.append(starts[1:], len(order))
+
+    groups = []
+    for code, start, stop in zip(group_codes, starts, stops):
+        values = []
+        for column_uniques in reversed(uniques):
+            code, column_code = divmod(code, len(column_uniques))
+            values.append(column_uniques[column_code])
+        groups.append((tuple(reversed(values)), slice(start, stop)))
+
+    return order, groups
+
+
+def facet_figure(
+    df: pd.DataFrame,
+    x,
+    y,
+    color,
+    facet_row,
+    color_map=None,
+    render_mode="webgl",
+    hover_data=(),
+    custom_data=(),
+    trace_meta=None,
+    shared=None,
+    facets=None,
+    x_title=None,
+    y_title=None,
+    x_range=None,
+    y_range=None,
+    template="plotly_white",
+) -> dict:
+    """
+    A line plot like px.line(df, x, y, color=color, facet_row=facet_row),
+    built as a plain figure dict straight from numpy arrays. dcc.Graph
+    takes the dict as is, so plotly.py never validates the traces, which
+    is most of the time px spends on figures with many samples.
+
+    Each facet row gets its own subplot axes, with the first facet at the
+    top, x axes matched and y axes independent. y_range, if given, is set
+    on every y axis, and x_range on the shared x axis. Colors come from
+    color_map, falling back to the Plotly palette in order of appearance.
+    Traces are Scattergl unless render_mode is "svg".
+
+    Each trace's customdata holds its hover_data columns and then its
+    custom_data columns, which aren't shown. trace_meta, if given, maps
+    (color, facet) to the meta of that trace.
+
+    shared, if given, is a table of traces with the same x and y columns
+    but no facet_row, such as a reference trace. Each of its traces is
+    drawn in every facet row, after df's, from arrays encoded only once.
+    facets, if given, are the facet rows in order, instead of those in df
+    in order of appearance.
+    """
+    # sample by sample, as px orders traces, so the legend matches
+    order, groups = group_slices(df, [color, facet_row])
+    x_values = df[x].to_numpy()[order]
+    y_values = df[y].to_numpy()[order]
+    custom = None
+    if hover_data or custom_data:
+        custom = np.column_stack(
+            [df[col].to_numpy()[order] for col in [*hover_data, *custom_data]]
+        )
+
+    if facets is None:
+        facets = pd.unique(df[facet_row])
+    facets = list(facets)
+    num_rows = len(facets)
+    if color_map is None:
+        palette = px.colors.qualitative.Plotly
+        colors = dict.fromkeys(sample for (sample, _), _ in groups)
+        if shared is not None:
+            colors.update(dict.fromkeys(pd.unique(shared[color])))
+        color_map = {
+            sample: palette[i % len(palette)] for i, sample in enumerate(colors)
+        }
+
+    base_hovertemplate = f"{color}=%{{fullData.name}}<br>{x}=%{{x}}<br>{y}=%{{y}}"
+    hovertemplate = base_hovertemplate
+    for i, col in enumerate(hover_data):
+        hovertemplate += f"<br>{col}=%{{customdata[{i}]}}"
+    hovertemplate += "<extra></extra>"
+
+    # the bottom row is axis 1, so the first facet, at the top, is the last
+    axis_of = {facet: num_rows - i for i, facet in enumerate(facets)}
+    height = (1 - ROW_SPACING * (num_rows - 1)) / max(num_rows, 1)
+
+    data = []
+    legend_samples = set()
+
+    def add_trace(sample, facet, x_array, y_array, hovertemplate):
+        axis = axis_of[facet]
+        suffix = "" if axis == 1 else str(axis)
+        trace = {
+            "type": "scatter" if render_mode == "svg" else "scattergl",
+            "mode": "lines",
+            "x": x_array,
+            "y": y_array,
+            "name": str(sample),
+            "legendgroup": str(sample),
+            "showlegend": sample not in legend_samples,
+            "line": {"color": color_map.get(sample)},
+            "xaxis": f"x{suffix}",
+            "yaxis": f"y{suffix}",
+            "hovertemplate": hovertemplate,
+        }
+        legend_samples.add(sample)
+        data.append(trace)
+        return trace
+
+    for (sample, facet), rows in groups:
+        trace = add_trace(
+            sample,
+            facet,
+            typed_array(x_values[rows]),
+            typed_array(y_values[rows]),
+            hovertemplate,
+        )
+        if custom is not None:
+            trace["customdata"] = typed_array(custom[rows])
+        if trace_meta is not None and (sample, facet) in trace_meta:
+            trace["meta"] = trace_meta[(sample, facet)]
+
+    if shared is not None:
+        order, shared_groups = group_slices(shared, [color])
+        x_values = shared[x].to_numpy()[order]
+        y_values = shared[y].to_numpy()[order]
+        for (sample,), rows in shared_groups:
+            x_array = typed_array(x_values[rows])
+            y_array = typed_array(y_values[rows])
+            for facet in facets:
+                add_trace(
+                    sample,
+                    facet,
+                    x_array,
+                    y_array,
+                    base_hovertemplate + "<extra></extra>",
+                )
+
+    layout = {
+        "template": template_json(template),
+        "legend": {"title": {"text": color}, "tracegroupgap": 0},
+        "margin": {"t": 60},
+        "annotations": [],
+    }
+    for facet, axis in axis_of.items():
+        suffix = "" if axis == 1 else str(axis)
+        bottom = (axis - 1) * (height + ROW_SPACING)
+        layout[f"xaxis{suffix}"] = {
+            "anchor": f"y{suffix}",
+            "domain": [0.0, 1 - LABEL_MARGIN],
+        }
+        layout[f"yaxis{suffix}"] = {
+            "anchor": f"x{suffix}",
+            "domain": [bottom, bottom + height],
+            "title": {"text": y if y_title is None else y_title},
+        }
+        if axis != 1:
+            layout[f"xaxis{suffix}"].update(matches="x", showticklabels=False)
+        if y_range is not None:
+            layout[f"yaxis{suffix}"]["range"] = list(y_range)
+
+        layout["annotations"].append(
+            {
+                "font": {},
+                "showarrow": False,
+                "text": str(facet),
+                "textangle": 90,
+                "x": 1 - LABEL_MARGIN,
+                "xanchor": "left",
+                "xref": "paper",
+                "y": bottom + height / 2,
+                "yanchor": "middle",
+                "yref": "paper",
+            }
+        )
+
+    if num_rows:
+        layout["xaxis"]["title"] = {"text": x if x_title is None else x_title}
+        if x_range is not None:
+            layout["xaxis"].update(autorange=False, range=list(x_range))
+
+    return {"data": data, "layout": layout}
@@ -0,0 +1,232 @@
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class ExperimentCache(object):
+    """
+    Least-recently-used cache of decoded Experiments, keyed by document id
+    and the level of HPLC data read (None for the full data), and holding
+    the revision each was decoded from. The total size of the cached
+    tables is kept under max_bytes.
+
+    Experiments go in and come out as copies, so callers are free to
+    renormalize or rename what they get back.
+    """
+
+    def __init__(self, max_bytes=256 * 1024**2):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return (
+            f"ExperimentCache with {len(self)} experiments "
+            f"({self.size / 1024**2:.1f} of {self.max_bytes / 1024**2:.1f} MB), "
+            f"{self.hits} hits and {self.misses} misses"
+        )
+
+    def info(self) -> dict:
+        return {
+            "experiments": len(self),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def get(self, id, rev, level=None):
+        with self._lock:
+            entry = self._entries.get((id, level))
+            if entry is None or rev is None or entry[0] != rev:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end((id, level))
+            self.hits += 1
+            exp = entry[1]
+
+        return exp.copy()
+
+    def put(self, id, rev, exp, level=None):
+        size = exp.memory_usage()
+        exp = exp.copy() if rev is not None and size <= self.max_bytes else None
+
+        with self._lock:
+            # only the entry being replaced goes, other levels stay
+            if (id, level) in self._entries:
+                self.size -= self._entries.pop((id, level))[2]
+            if exp is None:
+                return
+
+            self._entries[(id, level)] = (rev, exp, size)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                (old_id, _), (_, _, old_size) = self._entries.popitem(last=False)
+                self.size -= old_size
+                logging.debug(f"Evicted {old_id} from experiment cache")
+
+    def discard(self, id):
+        # every level of the experiment goes
+        with self._lock:
+            for key in [x for x in self._entries if x[0] == id]:
+                self.size -= self._entries.pop(key)[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class DiskCache(object):
+    """
+    Cache of byte strings in a local directory, shared by every process
+    using the same directory (e.g., the web server's gunicorn workers).
+
+    Entries are written to a temporary file and renamed into place, so a
+    reader sees a whole entry or nothing. Reading an entry touches it, and
+    once the directory grows past max_bytes the entries touched longest
+    ago are deleted. The directory is only scanned when a running
+    estimate of its size, which counts this process's writes since the
+    last scan, goes over max_bytes. Keys should change with whatever they
+    are built from (e.g., a document revision), so entries never go stale.
+    """
+
+    def __init__(self, directory, max_bytes=1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_environment(cls):
+        """
+        The cache in $APPIA_CACHE_DIR, limited to $APPIA_CACHE_SIZE_MB
+        (default 1024), or None if no directory is set.
+        """
+        directory = os.environ.get("APPIA_CACHE_DIR")
+        if not directory:
+            return None
+
+        size_mb = float(os.environ.get("APPIA_CACHE_SIZE_MB", 1024))
+        return cls(directory, int(size_mb * 1024**2))
+
+    def __repr__(self):
+        return (
+            f"DiskCache in {self.directory} (max {self.max_bytes / 1024**2:.1f} MB), "
+            f"{self.hits} hits and {self.misses} misses"
+        )
+
+    def path(self, key):
+        return os.path.join(
+            self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest()
+        )
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another process since we read it
+            pass
+
+        self.hits += 1
+        return data
+
+    def put(self, key, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self.path(key))
+        except OSError as e:
+            logging.warning(f"Could not write to cache in {self.directory}: {e}")
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            return
+
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += len(data)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def claim(self, key) -> bool:
+        """
+        True for the first process to claim key and False for the rest,
+        for work only one process sharing the cache should do. Claims are
+        empty entries, and age out like any other.
+        """
+        try:
+            fd = os.open(self.path(key), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+
+        os.close(fd)
+        return True
+
+    def entries(self):
+        # (mtime, path, size) for each entry, skipping half-written ones
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".tmp-"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, entry.path, stat.st_size))
+
+        return entries
+
+    def size(self) -> int:
+        return sum(x[2] for x in self.entries())
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(x[2] for x in entries)
+
+        for _, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # another process got there first
+                pass
+            total -= size
+
+        self._size = total
+
+    def clear(self):
+        for _, path, _ in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._size = 0
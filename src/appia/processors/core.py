@@ -1,9 +1,19 @@
 from math import floor
 from glob import glob
+from io import StringIO
+import codecs
 import logging
 import os
+import numpy as np
 import pandas as pd
 
+SNIFF_BYTES = 4096
+BYTE_ORDER_MARKS = (
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+
 
 def loading_bar(current, total, extension="", force=False):
     try:
@@ -38,6 +48,92 @@ def process_globs(globs):
     return globbed_files
 
 
+class FileSniff(object):
+    """
+    The extension and first few KB of a file. This is read once and
+    handed to every candidate processor's claim_sniff(), so claiming a
+    file costs a single open no matter how many processors look at it.
+    Decoded text is cached per encoding, so the UTF-16 CSV processors
+    share one decode.
+    """
+
+    def __init__(self, filename, head=None):
+        self.filename = filename
+        self.extension = self.extension_of(filename)
+        if head is None:
+            with open(filename, "rb") as f:
+                head = f.read(SNIFF_BYTES)
+        self.head = head
+        self._text = {}
+
+    @staticmethod
+    def extension_of(filename):
+        return os.path.splitext(filename)[1].lower()
+
+    def text(self, encoding="utf-8"):
+        if encoding not in self._text:
+            # the head may end partway through a character, which the
+            # incremental decoder tolerates and a plain decode does not
+            decoder = codecs.getincrementaldecoder(encoding)()
+            try:
+                self._text[encoding] = decoder.decode(self.head, final=False)
+            except UnicodeDecodeError:
+                self._text[encoding] = None
+        return self._text[encoding]
+
+    def first_line(self, encoding="utf-8"):
+        text = self.text(encoding)
+        if text is None:
+            return None
+        # StringIO gives us the same universal newlines as open()
+        return StringIO(text, newline=None).readline().rstrip()
+
+
+def sniff_encoding(head: bytes):
+    """
+    Returns the encoding and byte order mark length for the start of a
+    text file. Files without a BOM are UTF-16 if the second byte is zero
+    (vendor exports are ASCII text, stored two bytes at a time), and
+    UTF-8 otherwise.
+    """
+    for bom, encoding in BYTE_ORDER_MARKS:
+        if head.startswith(bom):
+            return encoding, len(bom)
+
+    if head[1:2] == b"\x00":
+        return "utf-16-le", 0
+
+    return "utf-8", 0
+
+
+def read_delimited(filename, **kwargs) -> pd.DataFrame:
+    """
+    Reads a vendor CSV/TSV export with pandas' C parser. The encoding
+    comes from the BOM and the delimiter from the first line. pandas
+    decodes the file as it reads it, so even a UTF-16 file never has to
+    go through the much slower python engine or be held in memory as
+    text. round_trip float parsing gives the same numbers the python
+    engine did.
+    """
+    with open(filename, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+        encoding, bom_length = sniff_encoding(head[:4])
+
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        first_line = decoder.decode(head[bom_length:]).split("\n")[0]
+        delimiter = "\t" if "\t" in first_line else ","
+
+        f.seek(bom_length)
+        return pd.read_csv(
+            f,
+            sep=delimiter,
+            engine="c",
+            encoding=encoding,
+            float_precision="round_trip",
+            **kwargs,
+        )
+
+
 def normalizer(df: pd.DataFrame, norm_range=None, strict=False):
     if not isinstance(df, pd.DataFrame):
         raise TypeError("df is not a pd.DataFrame")
@@ -59,6 +155,67 @@ def normalizer(df: pd.DataFrame, norm_range=None, strict=False):
     return df
 
 
+def normalize_groups(df: pd.DataFrame, by, norm_range=None, strict=False):
+    """
+    normalizer() for every group at once. Each group's min and max are
+    found with grouped reductions and broadcast back, instead of running
+    normalizer on a copy of every group. The output matches
+    groupby(by).apply(normalizer): same rows, same order.
+    """
+    if not isinstance(df, pd.DataFrame):
+        raise TypeError("df is not a pd.DataFrame")
+
+    # groupby drops rows with a missing key, and so does apply
+    codes = df.groupby(by, sort=False, observed=True).ngroup().to_numpy()
+    if (codes < 0).any():
+        df = df.loc[codes >= 0]
+        codes = codes[codes >= 0]
+    df = df.copy()
+
+    if len(df) == 0:
+        df["Normalized"] = df["Signal"]
+        return df
+
+    # sort rows by group so each group is one contiguous run for reduceat
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    new_group = np.diff(sorted_codes, prepend=-1) != 0
+    group_starts = np.flatnonzero(new_group)
+    # number the groups 0..n-1 so reduceat's output can be indexed by them
+    group_ids = np.empty_like(codes)
+    group_ids[order] = np.cumsum(new_group) - 1
+
+    def per_group(reducer, values):
+        # one value per group, broadcast back to every row in input order
+        reduced = reducer.reduceat(values[order], group_starts)
+        return reduced[group_ids]
+
+    ml = df["mL"].to_numpy()
+    signal = df["Signal"].to_numpy()
+
+    if norm_range:
+        in_range = (ml > min(norm_range)) & (ml < max(norm_range))
+    else:
+        in_range = (ml > 0.5) & (ml < per_group(np.fmax, ml))
+
+    # fmin/fmax skip NaN, like Series.min()
+    ranged = np.where(in_range, signal, np.nan)
+    if signal.dtype.kind == "f":
+        ranged = ranged.astype(signal.dtype, copy=False)
+
+    if strict:
+        min_sig = per_group(np.fmin, ranged)
+    else:
+        min_sig = per_group(np.fmin, signal)
+    max_sig = per_group(np.fmax, ranged)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df["Normalized"] = (signal - min_sig) / (max_sig - min_sig)
+    df.Normalized = df.Normalized.fillna(0)
+
+    return df
+
+
 def three_column_print(in_list):
     in_list = iter(in_list)
     for i in in_list:
@@ -4,13 +4,36 @@ import pandas as pd
 import sys
 import os
 import json
-from appia.processors.experiment import Experiment
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from appia.processors.experiment import (
+    HPLC_LEVELS,
+    Experiment,
+    attachment_names,
+    from_document,
+    pack_experiment,
+    unpack_experiment,
+    upgrade_document,
+)
+from appia.processors.cache import DiskCache, ExperimentCache
+from appia.processors.core import loading_bar
 from appia.parsers.user_settings import appia_settings
 
+MIGRATION_CHECKPOINT = "_local/appia-migration"
+
 
 class Database:
-    def __init__(self) -> None:
-        self.version = 4
+    def __init__(self, cache_mb=256) -> None:
+        self.version = 5
+        self.cache = ExperimentCache(cache_mb * 1024**2)
+        # shared with other processes, if $APPIA_CACHE_DIR is set
+        self.disk_cache = DiskCache.from_environment()
+        # experiment ids, kept up to date from the _changes feed
+        self._experiment_ids = set()
+        self._last_seq = None
+        self._list_lock = threading.Lock()
+        self._watcher = None
         username = appia_settings.database_user
         password = appia_settings.database_password
         hostname = appia_settings.database_host
@@ -84,48 +107,159 @@ class Database:
         return f"CouchDB at {appia_settings.database_host}"
 
     def update_experiment_list(self):
-        return [x["id"] for x in self.db.view("_all_docs")]
+        """
+        Applies every change since the last update to the in-memory id
+        list and returns it. The first call reads the feed from the start,
+        which lists every document, and later calls only fetch what has
+        changed since.
+        """
+        with self._list_lock:
+            since = 0 if self._last_seq is None else self._last_seq
+            self.apply_changes(self.db.changes(since=since))
 
-    def pull_experiment(self, id):
-        doc = self.db.get(id)
-        new_exp = Experiment(id)
+        return self.experiment_ids
 
-        try:
-            logging.debug(f'DB version: {self.version}\nExp version: {doc["version"]}')
+    @property
+    def experiment_ids(self):
+        # the list as of the last update, without asking the database
+        if self._last_seq is None:
+            return self.update_experiment_list()
+        return sorted(self._experiment_ids)
 
-            if doc["version"] == self.version:
-                new_exp.hplc = pd.read_json(doc["hplc"]).melt(
-                    id_vars=["mL", "Channel", "Time", "Normalization"],
-                    var_name="Sample",
-                    value_name="Value",
-                )
+    def apply_changes(self, changes):
+        # returns (id, rev) for each new or edited document
+        changed = []
+        for change in changes["results"]:
+            if change.get("deleted"):
+                self._experiment_ids.discard(change["id"])
+                self.cache.discard(change["id"])
+            else:
+                self._experiment_ids.add(change["id"])
+                if not change["id"].startswith("_design/"):
+                    changed.append((change["id"], change["changes"][0]["rev"]))
+        self._last_seq = changes["last_seq"]
 
-            elif doc["version"] == 3:
-                logging.info(
-                    f"{id} is a v3 Experiment. You should re-upload this Experiment."
-                )
-                new_exp.hplc = pd.read_json(doc["hplc"])
+        return changed
 
-            elif doc["version"] != self.version:
-                logging.error("Out of date experiment. Perform db migration.")
+    def watch_changes(self, timeout=60, on_change=None):
+        """
+        Keeps the experiment list current from a background thread which
+        long-polls the _changes feed, so reading experiment_ids never has
+        to wait on the database. on_change, if given, is called from that
+        thread with the id and revision of each document created or edited
+        after the watch starts.
+        """
+        if self._watcher is not None and self._watcher.is_alive():
+            return
 
-        except ValueError:
-            pass
-        except KeyError:
-            logging.error(
-                "No version number. Check experiment ID and perform db migration."
-            )
+        def watch():
+            while True:
+                try:
+                    if self._last_seq is None:
+                        self.update_experiment_list()
+                    changes = self.db.changes(
+                        feed="longpoll", since=self._last_seq, timeout=timeout * 1000
+                    )
+                    with self._list_lock:
+                        changed = self.apply_changes(changes)
+                    if on_change is not None:
+                        for id, rev in changed:
+                            on_change(id, rev)
+                except Exception as e:
+                    logging.warning(f"Lost the CouchDB changes feed: {e}")
+                    time.sleep(timeout / 10)
 
+        self._watcher = threading.Thread(
+            target=watch, name="appia-changes", daemon=True
+        )
+        self._watcher.start()
+
+    def current_rev(self, id):
+        # a HEAD request gets the revision (as the ETag) without the body
         try:
-            new_exp.fplc = pd.read_json(doc["fplc"])
-        except ValueError:
-            pass
-        except KeyError:
-            new_exp.fplc = None
+            _, headers, _ = self.db.resource(id).head()
+        except couchdb.http.ResourceNotFound:
+            return None
+        return headers.get("ETag", "").strip('"') or None
+
+    def pull_experiment(self, id, level=None):
+        """
+        Pulls an experiment with its HPLC data at the smallest stored level
+        with at least level points per trace, or in full if level is None.
+        Only the attachments that level needs are downloaded, and decoded
+        experiments are reused until their document changes, from memory
+        or from the disk cache another process may have filled.
+        """
+        rev = self.current_rev(id)
+        exp = self.cache.get(id, rev, level)
+
+        if exp is None and self.disk_cache is not None and rev is not None:
+            data = self.disk_cache.get(f"experiment {id} {rev} {level}")
+            if data is not None:
+                exp = unpack_experiment(data)
+                self.cache.put(id, rev, exp, level)
+
+        if exp is None:
+            doc = self.db.get(id)
+            if doc is None:
+                return from_document(doc, level)
+            exp = self.decode_document(doc, level)
+
+        return exp
+
+    def decode_document(self, doc, level=None, downloaded=None):
+        """
+        Decodes and caches what pull_experiment(doc id, level) gives for
+        this revision of doc, downloading only the attachments that level
+        needs. downloaded, if given, is a dict of attachments already
+        downloaded, which new ones are added to.
+        """
+        if downloaded is None:
+            downloaded = {}
+
+        names = attachment_names(doc, level)
+        for name in names:
+            if name not in downloaded:
+                downloaded[name] = self.db.get_attachment(doc, name).read()
+
+        exp = from_document(doc, level, {x: downloaded[x] for x in names})
+        self.store_experiment(doc["_id"], doc.get("_rev"), exp, level)
+        return exp
 
-        return new_exp
+    def store_experiment(self, id, rev, exp, level=None):
+        # what pull_experiment(id, level) should give for this revision
+        self.cache.put(id, rev, exp, level)
+        if self.disk_cache is not None and rev is not None:
+            self.disk_cache.put(f"experiment {id} {rev} {level}", pack_experiment(exp))
+
+    def warm_experiment(self, id, levels=HPLC_LEVELS):
+        """
+        Decodes an experiment into the caches ahead of its first view, in
+        full and at each of levels, just as pull_experiment would. The
+        document is fetched once, and each attachment downloaded once.
+        """
+        doc = self.db.get(id)
+        if doc is None:
+            return
+
+        downloaded = {}
+        for level in [None, *levels]:
+            self.decode_document(doc, level, downloaded)
+
+    def pull_experiments(self, ids, max_workers=8, level=None):
+        """
+        Pulls several experiments at once, in the order given. couchdb's
+        connection pool is shared between the threads, and decoding mostly
+        happens in numpy and zlib, outside the GIL.
+        """
+        if len(ids) < 2:
+            return [self.pull_experiment(x, level) for x in ids]
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(ids))) as executor:
+            return list(executor.map(lambda x: self.pull_experiment(x, level), ids))
 
     def remove_experiment(self, exp_id):
+        self.cache.discard(exp_id)
         try:
             self.db.delete(self.db[exp_id])
         except couchdb.http.ResourceNotFound:
@@ -133,7 +267,7 @@ class Database:
 
     def upload_experiment(self, exp, overwrite=False):
         logging.info(f"Uploading {exp} to {self}")
-        doc = exp.jsonify()
+        doc = exp.to_document()
 
         try:
             self.db.save(doc)
@@ -147,44 +281,120 @@ class Database:
             old_exp = self.pull_experiment(exp.id)
 
             merged_exp = Experiment(exp.id)
-            if exp.hplc is not None:
-                if old_exp.hplc is not None:
+            merged_exp.levels = exp.levels
+            if exp.compact_hplc is not None:
+                if old_exp.compact_hplc is not None:
                     if input("Overwrite old HPLC data? Y/N\n").lower() == "y":
-                        merged_exp.hplc = exp.hplc
+                        merged_exp.hplc = exp.compact_hplc
                     else:
-                        merged_exp.hplc = old_exp.hplc
+                        merged_exp.hplc = old_exp.compact_hplc
                 else:
-                    merged_exp.hplc = exp.hplc
+                    merged_exp.hplc = exp.compact_hplc
             else:
-                merged_exp.hplc = old_exp.hplc
+                merged_exp.hplc = old_exp.compact_hplc
 
-            if exp.fplc is not None:
-                if old_exp.fplc is not None:
+            if exp.compact_fplc is not None:
+                if old_exp.compact_fplc is not None:
                     if input("Overwrite old FPLC data? Y/N\n").lower() == "y":
-                        merged_exp.fplc = exp.fplc
+                        merged_exp.fplc = exp.compact_fplc
                     else:
-                        merged_exp.fplc = old_exp.fplc
+                        merged_exp.fplc = old_exp.compact_fplc
                 else:
-                    merged_exp.fplc = exp.fplc
+                    merged_exp.fplc = exp.compact_fplc
             else:
-                merged_exp.fplc = old_exp.fplc
+                merged_exp.fplc = old_exp.compact_fplc
 
             self.remove_experiment(exp.id)
-            doc = merged_exp.jsonify()
+            doc = merged_exp.to_document()
             self.db.save(doc)
 
-    def migrate(self):
+    def migrate(self, jobs=None, page_size=50):
         if (
             input(
                 f"To migrate database hosted at {appia_settings.database_host}, type: I have backed up my db\n"
             ).lower()
             == "i have backed up my db"
         ):
-            for exp_name in self.update_experiment_list():
-                exp = self.pull_experiment(exp_name)
-                self.upload_experiment(exp, overwrite=True)
+            self.migrate_documents(jobs, page_size)
         else:
             logging.warning("Back up your database before migrating it.")
 
+    def migrate_documents(self, jobs=None, page_size=50):
+        """
+        Rewrites every out of date document in the current version.
+
+        Documents are read a page at a time in id order, converted in a
+        pool of worker processes, and written back with one _bulk_docs
+        request per page, under their existing revisions. After each page
+        the last id done is saved to a local (unreplicated) checkpoint
+        document, so an interrupted migration picks up where it stopped.
+        A document edited mid-migration conflicts and is left for the next
+        run rather than overwritten.
+        """
+        checkpoint = self.db.get(MIGRATION_CHECKPOINT) or {"_id": MIGRATION_CHECKPOINT}
+        if checkpoint.get("version") != self.version:
+            checkpoint.update(
+                version=self.version, last_id=None, seen=0, migrated=0, failed=[]
+            )
+        elif checkpoint["last_id"] is not None:
+            logging.info(f'Resuming migration after {checkpoint["last_id"]}')
+
+        total = self.db.info()["doc_count"]
+        start_time = time.time()
+        start_seen = checkpoint["seen"]
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            while True:
+                options = {"include_docs": True, "limit": page_size}
+                if checkpoint["last_id"] is not None:
+                    options.update(startkey=checkpoint["last_id"], skip=1)
+                rows = list(self.db.view("_all_docs", **options))
+                if not rows:
+                    break
+
+                conversions = {
+                    row.id: executor.submit(upgrade_document, row.doc)
+                    for row in rows
+                    if not row.id.startswith("_design/")
+                    and row.doc.get("version") != self.version
+                }
+                new_docs = []
+                for doc_id, conversion in conversions.items():
+                    try:
+                        new_docs.append(conversion.result())
+                    except Exception as e:
+                        logging.error(f"Could not convert {doc_id}: {e}")
+                        checkpoint["failed"].append(doc_id)
+
+                for success, doc_id, result in self.db.update(new_docs):
+                    if success:
+                        checkpoint["migrated"] += 1
+                        self.cache.discard(doc_id)
+                    else:
+                        logging.error(f"Could not migrate {doc_id}: {result}")
+                        checkpoint["failed"].append(doc_id)
+
+                checkpoint["last_id"] = rows[-1].id
+                checkpoint["seen"] += len(rows)
+                self.db.save(checkpoint)
+
+                rate = (checkpoint["seen"] - start_seen) / (time.time() - start_time)
+                loading_bar(
+                    min(checkpoint["seen"], total),
+                    total,
+                    extension=f"  {rate:.1f} docs/s",
+                )
+
+        logging.info(
+            f'Migrated {checkpoint["migrated"]} experiments to version {self.version}'
+        )
+        if checkpoint["failed"]:
+            logging.warning(
+                f'{len(checkpoint["failed"])} failed: {", ".join(checkpoint["failed"])}'
+            )
+        # finished, so the next migration starts from the beginning
+        if "_rev" in checkpoint:
+            self.db.delete(checkpoint)
+
 
 db = Database()
@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+METHODS = ("lttb", "minmax")
+
+
+def group_runs(df: pd.DataFrame, by, x):
+    """
+    Row positions sorting df by group and then x, with the start and size
+    of each group's run in that order.
+    """
+    codes = df.groupby(by, sort=False, observed=True).ngroup().to_numpy()
+    valid = np.flatnonzero(codes >= 0)
+    order = valid[np.lexsort((df[x].to_numpy()[valid], codes[valid]))]
+
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.diff(sorted_codes, prepend=-1))
+    sizes = np.diff(np.append(starts, len(order)))
+
+    return order, starts, sizes
+
+
+def ranges(starts, stops):
+    # concatenated np.arange(start, stop) for every pair, in one go
+    lengths = stops - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return np.arange(lengths.sum()) + offsets, lengths
+
+
+def first_max(values, lengths):
+    # position of the first maximum in each consecutive run of values
+    run_starts = np.cumsum(lengths) - lengths
+    run_max = np.maximum.reduceat(values, run_starts)
+    is_max = np.flatnonzero(values == np.repeat(run_max, lengths))
+    run_of_max = np.searchsorted(run_starts, is_max, side="right") - 1
+    _, first = np.unique(run_of_max, return_index=True)
+    return is_max[first]
+
+
+def lttb_indices(x, y, starts, sizes, num_points) -> np.ndarray:
+    """
+    Largest-triangle-three-buckets for every group at once. x and y are
+    sorted by group and then x, and each group is a run given by starts
+    and sizes. Each group keeps its first and last points, and from each
+    of num_points - 2 buckets between them the point making the largest
+    triangle with the last point kept and the mean of the next bucket.
+
+    Buckets depend on the one before, so this loops over buckets, but
+    each step handles that bucket in every group together.
+    """
+    keep = [np.arange(s, s + n) for s, n in zip(starts, sizes) if n <= num_points]
+    long = sizes > num_points
+    starts = starts[long]
+    sizes = sizes[long]
+
+    if len(starts) == 0:
+        return np.sort(np.concatenate(keep + [np.array([], dtype=np.int64)]))
+
+    keep.extend([starts, starts + sizes - 1])
+    if num_points < 3:
+        return np.sort(np.concatenate(keep))
+
+    # nan_to_num so a gap in the trace can't poison a whole bucket's sums
+    y = np.nan_to_num(y)
+    x_sums = np.concatenate([[0], np.cumsum(x)])
+    y_sums = np.concatenate([[0], np.cumsum(y)])
+
+    bucket_width = (sizes - 2) / (num_points - 2)
+
+    def bucket_edge(i):
+        return starts + np.floor(i * bucket_width).astype(np.int64) + 1
+
+    last_x = x[starts]
+    last_y = y[starts]
+    for bucket in range(num_points - 2):
+        bucket_start = bucket_edge(bucket)
+        next_start = bucket_edge(bucket + 1)
+        next_stop = np.maximum(bucket_edge(bucket + 2), next_start + 1)
+        next_stop = np.minimum(next_stop, starts + sizes)
+        next_size = next_stop - next_start
+        next_x = (x_sums[next_stop] - x_sums[next_start]) / next_size
+        next_y = (y_sums[next_stop] - y_sums[next_start]) / next_size
+
+        candidates, lengths = ranges(bucket_start, next_start)
+        group_of = np.repeat(np.arange(len(starts)), lengths)
+        area = np.abs(
+            (last_x[group_of] - next_x[group_of]) * (y[candidates] - last_y[group_of])
+            - (last_x[group_of] - x[candidates]) * (next_y[group_of] - last_y[group_of])
+        )
+
+        chosen = candidates[first_max(area, lengths)]
+        keep.append(chosen)
+        last_x = x[chosen]
+        last_y = y[chosen]
+
+    return np.sort(np.concatenate(keep))
+
+
+def minmax_indices(x, y, starts, sizes, num_points) -> np.ndarray:
+    """
+    Keeps the first and last point of every group, then splits it into
+    (num_points - 2) // 2 buckets of equal point count and keeps the
+    lowest and highest point in each, so no peak or trough is lost however
+    narrow. Arguments as for lttb_indices.
+    """
+    keep = [np.arange(s, s + n) for s, n in zip(starts, sizes) if n <= num_points]
+    long = sizes > num_points
+    starts = starts[long]
+    sizes = sizes[long]
+
+    if len(starts) == 0:
+        return np.sort(np.concatenate(keep + [np.array([], dtype=np.int64)]))
+
+    keep.extend([starts, starts + sizes - 1])
+    num_buckets = max((num_points - 2) // 2, 1)
+    rows, lengths = ranges(starts, starts + sizes)
+    position = rows - np.repeat(starts, lengths)
+    bucket = np.repeat(np.arange(len(starts)) * num_buckets, lengths) + (
+        position * num_buckets // np.repeat(sizes, lengths)
+    )
+
+    # sorting by bucket then y puts each bucket's min first and max last
+    order = np.lexsort((np.nan_to_num(y[rows]), bucket))
+    bucket_starts = np.flatnonzero(np.diff(bucket[order], prepend=-1))
+    bucket_stops = np.append(bucket_starts[1:], len(order)) - 1
+    keep.extend([rows[order[bucket_starts]], rows[order[bucket_stops]]])
+
+    return np.unique(np.concatenate(keep))
+
+
+def decimate(df: pd.DataFrame, by, x, y, num_points, method="lttb"):
+    """
+    Reduces every group of df to at most num_points rows, chosen from the
+    group's (x, y) trace by LTTB or min-max bucketing. Rows keep their
+    order in df, and every column of a kept row is kept.
+    """
+    if method == "lttb":
+        indices = lttb_indices
+    elif method == "minmax":
+        indices = minmax_indices
+    else:
+        raise ValueError(f"Unknown decimation method {method}")
+
+    order, starts, sizes = group_runs(df, by, x)
+    x_values = df[x].to_numpy(dtype=np.float64)[order]
+    y_values = df[y].to_numpy(dtype=np.float64)[order]
+
+    kept = indices(x_values, y_values, starts, sizes, num_points)
+    return df.iloc[np.sort(order[kept])]
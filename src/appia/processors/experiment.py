@@ -1,65 +1,351 @@
 import pandas as pd
+import numpy as np
 import os
-from appia.processors.core import normalizer
-from math import ceil
+import json
+import base64
+import logging
+from io import BytesIO, StringIO
+from appia.processors.core import normalize_groups
+from appia.processors.decimate import decimate
+
+HPLC_COLUMNS = ["mL", "Sample", "Channel", "Time"]
+FPLC_COLUMNS = ["mL", "CV", "Channel", "Fraction", "Sample"]
+LABEL_COLUMNS = ["Sample", "Channel"]
+VALUE_COLUMNS = ["Signal", "Normalized"]
+# points per trace in the reduced copies of the HPLC data stored alongside
+# the full data, for views which don't need every point
+HPLC_LEVELS = (500, 5000, 50000)
+
+
+def as_category(series: pd.Series) -> pd.Series:
+    # categories are kept sorted so sorting by the column is lexical, as
+    # it was for plain strings
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = series.cat.categories
+        if not categories.is_monotonic_increasing:
+            series = series.cat.reorder_categories(categories.sort_values())
+        return series
+    return series.astype("category")
+
+
+def compact_table(df: pd.DataFrame, id_columns) -> pd.DataFrame:
+    """
+    One row per point, with the raw and normalized signal side by side
+    and Sample/Channel stored as categories. Long tables
+    (Normalization and Value columns) are pivoted into this shape; compact
+    tables are only converted. Id columns keep the order they had in df.
+    """
+    id_columns = [x for x in df.columns if x in id_columns]
+    if "Normalization" in df.columns:
+        df = df.pivot(index=id_columns, columns="Normalization", values="Value")
+        df = df.reindex(columns=VALUE_COLUMNS).reset_index()
+        df.columns.name = None
+        # samples pivoted into one table (as in the database) leave
+        # empty rows wherever their points don't line up
+        df = df.dropna(subset=VALUE_COLUMNS, how="all")
+    else:
+        df = df[id_columns + VALUE_COLUMNS].copy()
+
+    for column in LABEL_COLUMNS:
+        df[column] = as_category(df[column])
+    # values keep the precision the vendor file gave them
+    for column in VALUE_COLUMNS:
+        if not pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].astype(np.float64)
+
+    return df.reset_index(drop=True)
+
+
+def concat_tables(tables) -> pd.DataFrame:
+    # concatenating categoricals only keeps the dtype if the categories
+    # match, so give every table the union of them first
+    tables = [x for x in tables if x is not None]
+    for column in LABEL_COLUMNS:
+        categories = (
+            pd.Index([])
+            .append([x[column].cat.categories for x in tables])
+            .unique()
+            .sort_values()
+        )
+        tables = [
+            x.assign(**{column: x[column].cat.set_categories(categories)})
+            for x in tables
+        ]
+
+    return pd.concat(tables, ignore_index=True)
+
+
+def wide_table(compact: pd.DataFrame) -> pd.DataFrame:
+    """
+    Signal by Time, one column per "Sample Channel", as pivot_table would
+    give it (duplicate points averaged, columns sorted by name). Rows and
+    columns come from sorting the Time values and label codes once, and
+    the cells are filled with bincount, rather than grouping strings.
+    """
+    compact = compact.loc[compact["Signal"].notna() & compact["Time"].notna()]
+    signal = compact["Signal"].to_numpy()
+
+    sample_codes = compact["Sample"].cat.codes.to_numpy().astype(np.int64)
+    channel_codes = compact["Channel"].cat.codes.to_numpy().astype(np.int64)
+    pair_codes, column = np.unique(
+        sample_codes * len(compact["Channel"].cat.categories) + channel_codes,
+        return_inverse=True,
+    )
+    samples = compact["Sample"].cat.categories[
+        pair_codes // len(compact["Channel"].cat.categories)
+    ]
+    channels = compact["Channel"].cat.categories[
+        pair_codes % len(compact["Channel"].cat.categories)
+    ]
+    labels = np.array([f"{s} {c}" for s, c in zip(samples, channels)], dtype=object)
+
+    # columns are sorted by their label, not by sample and channel separately
+    label_order = np.argsort(labels, kind="stable")
+    column = np.argsort(label_order)[column]
+    labels = labels[label_order]
+
+    times, row = np.unique(compact["Time"].to_numpy(), return_inverse=True)
+
+    cell = row * len(labels) + column
+    size = len(times) * len(labels)
+    counts = np.bincount(cell, minlength=size)
+    sums = np.bincount(cell, weights=signal, minlength=size)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = np.where(counts > 0, sums / counts, np.nan)
+
+    return pd.DataFrame(
+        means.reshape(len(times), len(labels)).astype(signal.dtype, copy=False),
+        index=pd.Index(times, name="Time"),
+        columns=pd.Index(labels, name="Sample"),
+    )
+
+
+def table_arrays(table: pd.DataFrame, prefix=""):
+    """
+    One array per column of the table, named prefix + column, with
+    categoricals as their codes. Returns the arrays and the metadata
+    needed to rebuild the table from them.
+    """
+    arrays = {}
+    metadata = {"rows": len(table), "columns": []}
+
+    for column in table.columns:
+        values = table[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            arrays[prefix + column] = values.cat.codes.to_numpy()
+            metadata["columns"].append(
+                {"name": column, "categories": values.cat.categories.tolist()}
+            )
+        else:
+            arrays[prefix + column] = values.to_numpy()
+            metadata["columns"].append({"name": column})
+
+    return arrays, metadata
+
+
+def arrays_table(arrays, metadata, prefix="") -> pd.DataFrame:
+    # the reverse of table_arrays
+    table = {}
+    for column in metadata["columns"]:
+        values = arrays[prefix + column["name"]]
+        if "categories" in column:
+            values = pd.Categorical.from_codes(values, column["categories"])
+        table[column["name"]] = values
+
+    return pd.DataFrame(table)
+
+
+def encode_table(table: pd.DataFrame):
+    """
+    Returns the table as compressed npz bytes (see table_arrays) and the
+    metadata needed to rebuild it.
+    """
+    arrays, metadata = table_arrays(table)
+    buffer = BytesIO()
+    np.savez_compressed(buffer, **arrays)
+
+    return buffer.getvalue(), metadata
+
+
+def decode_table(data: bytes, metadata) -> pd.DataFrame:
+    with np.load(BytesIO(data), allow_pickle=False) as arrays:
+        return arrays_table(arrays, metadata)
+
+
+def npz_attachment(data: bytes) -> dict:
+    return {
+        "content_type": "application/octet-stream",
+        "data": base64.b64encode(data).decode("ascii"),
+    }
+
+
+def hplc_levels(compact: pd.DataFrame, levels=HPLC_LEVELS, method="minmax") -> dict:
+    """
+    Reduced copies of a compact HPLC table, keyed by points per trace.
+    Levels with at least as many points as the longest trace would just
+    repeat the full table, so they are left out.
+    """
+    if compact is None or len(compact) == 0:
+        return {}
+
+    longest = compact.groupby(LABEL_COLUMNS, observed=True).size().max()
+    return {
+        level: decimate(
+            compact, ["Channel", "Sample"], "mL", "Signal", level, method
+        ).reset_index(drop=True)
+        for level in sorted(set(levels))
+        if level < longest
+    }
+
+
+def hplc_attachment(doc, level=None):
+    """
+    Name and metadata of the stored HPLC table to read for at least level
+    points per trace: the smallest level with enough, or the full table
+    if there is none or level is None.
+    """
+    stored = doc.get("hplc_levels") or {}
+    if level is not None:
+        for stored_level in sorted(int(x) for x in stored):
+            if stored_level >= level:
+                return f"hplc-{stored_level}.npz", stored[str(stored_level)]
+
+    return "hplc.npz", doc["hplc"]
+
+
+def attachment_names(doc, level=None) -> list:
+    # the attachments from_document will read for this level
+    if doc.get("version") != 5:
+        return []
+
+    names = []
+    if doc["hplc"] is not None:
+        names.append(hplc_attachment(doc, level)[0])
+    if doc["fplc"] is not None:
+        names.append("fplc.npz")
+
+    return names
+
+
+def long_table(compact: pd.DataFrame, id_columns, value_order) -> pd.DataFrame:
+    """
+    The long format Appia has always used: one row per point per
+    Normalization, with the signal in a single Value column.
+    """
+    id_columns = [x for x in compact.columns if x in id_columns]
+    num_rows = len(compact)
+    long = pd.concat([compact[id_columns]] * len(value_order), ignore_index=True)
+    long["Normalization"] = pd.Categorical.from_codes(
+        np.repeat(np.arange(len(value_order)), num_rows), categories=value_order
+    )
+    long["Value"] = np.concatenate([compact[x].to_numpy() for x in value_order])
+
+    return long
 
 
 class Experiment:
+    """
+    HPLC and FPLC data are stored compactly (see compact_table). The hplc
+    and fplc properties build the long tables on request, and accept
+    either format when set.
+    """
+
     def __init__(self, id) -> None:
         self.id = id
-        self.version = 4
+        self.version = 5
         self._hplc = None
         self._fplc = None
+        self._wide = [None]
+        self.levels = HPLC_LEVELS
+        # revision of the document this was read from, if any
+        self.rev = None
 
     @property
-    def hplc(self):
+    def compact_hplc(self):
         try:
             return self._hplc
         except AttributeError:
             return None
 
+    @property
+    def compact_fplc(self):
+        try:
+            return self._fplc
+        except AttributeError:
+            return None
+
+    @property
+    def hplc(self):
+        if self.compact_hplc is None:
+            return None
+        # Normalized first, the order the long table used to be sorted in
+        return long_table(self._hplc, HPLC_COLUMNS, ["Normalized", "Signal"])
+
     @hplc.setter
     def hplc(self, df):
-        if isinstance(df, pd.DataFrame) or df is None:
-            try:
-                self._hplc = df.sort_values(by=["Normalization", "Channel", "mL"])
-            except AttributeError:
-                self._hplc = df
+        self._wide = [None]
+        if df is None:
+            self._hplc = None
+        elif isinstance(df, pd.DataFrame):
+            df = compact_table(df, HPLC_COLUMNS)
+            self._hplc = df.sort_values(by=["Channel", "mL", "Sample", "Time"])
+            self._hplc.reset_index(drop=True, inplace=True)
         else:
             raise TypeError("HPLC input is not a pandas dataframe")
 
     @property
     def fplc(self):
-        try:
-            return self._fplc
-        except AttributeError:
+        if self.compact_fplc is None:
             return None
+        return long_table(self._fplc, FPLC_COLUMNS, ["Signal", "Normalized"])
 
     @fplc.setter
     def fplc(self, df):
-        if isinstance(df, pd.DataFrame) or df is None:
-            self._fplc = df
+        if df is None:
+            self._fplc = None
+        elif isinstance(df, pd.DataFrame):
+            self._fplc = compact_table(df, FPLC_COLUMNS)
         else:
             raise TypeError("FPLC input is not a pandas dataframe")
 
     @property
     def wide(self):
-        wide = self.hplc.copy()
-        wide = wide.loc[wide["Normalization"] == "Signal"]
-        wide["Sample"] = wide["Sample"].astype(str) + " " + wide["Channel"]
-        wide.drop(["Channel", "Normalization"], axis=1)
-        wide = wide.pivot_table(index="Time", columns="Sample", values="Value")
-        return wide
+        # built on first use and kept until the HPLC data changes. Copies
+        # share the slot it is kept in until one of them changes its data,
+        # so a table built from a cached experiment's copy stays cached.
+        if self._wide[0] is None:
+            self._wide[0] = wide_table(self.compact_hplc)
+        return self._wide[0]
+
+    def copy(self):
+        new_exp = Experiment(self.id)
+        new_exp.version = self.version
+        new_exp.levels = self.levels
+        new_exp.rev = self.rev
+        for name in ["_hplc", "_fplc"]:
+            table = getattr(self, name, None)
+            setattr(new_exp, name, None if table is None else table.copy())
+        new_exp._wide = self._wide
+
+        return new_exp
+
+    def memory_usage(self) -> int:
+        # bytes held by the tables
+        return sum(
+            int(table.memory_usage(deep=True).sum())
+            for table in [self.compact_hplc, self.compact_fplc]
+            if table is not None
+        )
 
     def __repr__(self):
         to_return = f'Experiment "{self.id}" with '
-        if self.hplc is not None:
+        if self.compact_hplc is not None:
             to_return += "HPLC "
-        if self.hplc is not None and self.fplc is not None:
+        if self.compact_hplc is not None and self.compact_fplc is not None:
             to_return += "and "
-        if self.fplc is not None:
+        if self.compact_fplc is not None:
             to_return += "FPLC "
-        if self.hplc is None and self.fplc is None:
+        if self.compact_hplc is None and self.compact_fplc is None:
             to_return += "no "
         to_return += "data"
 
@@ -69,7 +355,9 @@ class Experiment:
         if not isinstance(hplc, pd.DataFrame):
             raise TypeError(f"Tried to extend experiment hplc with {type(hplc)}")
 
-        self.hplc = pd.concat([self.hplc, hplc])
+        self.hplc = concat_tables(
+            [self.compact_hplc, compact_table(hplc, HPLC_COLUMNS)]
+        )
 
     def show_tables(self):
         print("HPLC:")
@@ -77,95 +365,92 @@ class Experiment:
         print("FPLC:")
         print(self.fplc)
 
-    def jsonify(self):
-        if self.hplc is not None:
-            hplc_json = (
-                self.hplc.pivot_table(
-                    index=["mL", "Channel", "Time", "Normalization"],
-                    columns="Sample",
-                    values="Value",
-                )
-                .reset_index()
-                .to_json()
-            )
-        else:
-            hplc_json = ""
-
-        if self.fplc is not None:
-            fplc_json = self.fplc.to_json()
-        else:
-            fplc_json = ""
-
+    def to_document(self):
+        """
+        CouchDB document for this experiment. Each table is a compressed
+        npz attachment, with its row count and categories in the body.
+        The HPLC table is also stored reduced to each of self.levels points
+        per trace (see hplc_levels), listed in the body under hplc_levels.
+        """
         doc = {
             "_id": self.id,
             "version": self.version,
-            "hplc": hplc_json,
-            "fplc": fplc_json,
+            "_attachments": {},
         }
 
+        for name, table in [("hplc", self.compact_hplc), ("fplc", self.compact_fplc)]:
+            if table is None:
+                doc[name] = None
+                continue
+
+            data, doc[name] = encode_table(table)
+            doc["_attachments"][f"{name}.npz"] = npz_attachment(data)
+
+        levels = hplc_levels(self.compact_hplc, self.levels)
+        if levels:
+            doc["hplc_levels"] = {}
+        for level, table in levels.items():
+            data, doc["hplc_levels"][str(level)] = encode_table(table)
+            doc["_attachments"][f"hplc-{level}.npz"] = npz_attachment(data)
+
         return doc
 
+    def scale_hplc(self, factor):
+        if self.compact_hplc is None:
+            raise ValueError("No HPLC data")
+
+        # normalized values don't change with scale
+        self._hplc["Signal"] = self._hplc["Signal"] * factor
+        self._wide = [None]
+
     def renormalize_hplc(self, norm_range, strict):
-        if self.hplc is None:
+        if self.compact_hplc is None:
             raise ValueError("No HPLC data")
 
-        # this arcane string of pandas commands is the equivalent of pivot_wider from tidyverse
-        # from https://medium.com/@durgaswaroop/reshaping-pandas-dataframes-melt-and-unmelt-9f57518c7738;.'/
-        hplc = self.hplc.pivot(
-            index=["mL", "Sample", "Channel", "Time"], columns=["Normalization"]
-        )["Value"].reset_index()
-        hplc = hplc.groupby(["Sample", "Channel"], group_keys=False).apply(
-            lambda x: normalizer(x, norm_range, strict)
+        self.hplc = normalize_groups(
+            self._hplc, ["Sample", "Channel"], norm_range, strict
         )
-        hplc = hplc.melt(
-            id_vars=["mL", "Sample", "Channel", "Time"],
-            value_vars=["Signal", "Normalized"],
-            var_name="Normalization",
-            value_name="Value",
-        )
-        self.hplc = hplc
 
     def renormalize_fplc(self, norm_range, strict):
-        if self.fplc is None:
+        if self.compact_fplc is None:
             raise ValueError("No FPLC data")
 
-        fplc = self.fplc.pivot(
-            index=["mL", "CV", "Fraction", "Channel", "Sample"],
-            columns=["Normalization"],
-        )["Value"].reset_index()
-        fplc = fplc.groupby(["Sample", "Channel"], group_keys=False).apply(
-            lambda x: normalizer(x, norm_range, strict)
-        )
-        fplc = fplc.melt(
-            id_vars=["mL", "CV", "Channel", "Fraction", "Sample"],
-            value_vars=["Signal", "Normalized"],
-            var_name="Normalization",
-            value_name="Value",
+        self.fplc = normalize_groups(
+            self._fplc, ["Sample", "Channel"], norm_range, strict
         )
-        self.fplc = fplc
-
-    def reduce_hplc(self, num_points):
-        # reduce the number of points in the hplc trace to num_points per sample/channel/norm
 
-        def reduction_factor(df, final_points):
-            reduction_factor = ceil(df.shape[0] / final_points)
-            return df[::reduction_factor]
-
-        try:
-            self.hplc = self.hplc.groupby(
-                ["Channel", "Sample", "Normalization"], group_keys=False, as_index=False
-            ).apply(lambda x: reduction_factor(x, num_points))
-            self.hplc = self.hplc.reset_index(drop=True)
-        except AttributeError:
+    def reduce_hplc(self, num_points, method="lttb"):
+        # reduce the hplc trace to num_points per sample/channel. Points are
+        # picked from Signal, which also suits Normalized: it is the same
+        # trace rescaled, so the same points are the important ones.
+        if self.compact_hplc is None:
             return
 
+        self._hplc = decimate(
+            self._hplc, ["Channel", "Sample"], "mL", "Signal", num_points, method
+        ).reset_index(drop=True)
+        self._wide = [None]
+
     def rename_channels(self, channel_name_dict):
-        self.hplc = self.hplc.replace({"Channel": channel_name_dict})
+        self._wide = [None]
+        channels = self._hplc["Channel"]
+        renaming = {
+            old: channel_name_dict.get(old, old) for old in channels.cat.categories
+        }
+        if len(set(renaming.values())) == len(renaming):
+            self._hplc["Channel"] = as_category(
+                channels.cat.rename_categories(renaming)
+            )
+        else:
+            # two channels are getting the same name, which categories can't do
+            self._hplc["Channel"] = as_category(
+                channels.astype(object).replace(renaming)
+            )
 
     def hplc_csv(self, outfile):
         if outfile[-4:] == ".csv":
             outfile = outfile[:-4]
-        if self.hplc is not None:
+        if self.compact_hplc is not None:
             self.hplc.to_csv(outfile + "-long.csv", index=False)
             self.wide.to_csv(outfile + "-wide.csv", index=True)
 
@@ -175,7 +460,7 @@ class Experiment:
         if outfile[-4:] != ".csv":
             outfile = outfile + ".csv"
 
-        if self.fplc is not None:
+        if self.compact_fplc is not None:
             self.fplc.to_csv(outfile, index=False)
             return outfile
 
@@ -190,25 +475,144 @@ def concat_experiments(exp_list):
     hplcs = []
     fplcs = []
 
-    for exp in [x for x in exp_list if x.hplc is not None]:
-        hplc = exp.hplc
-        hplc["Sample"] = f"{exp.id}: " + hplc["Sample"].astype(str)
+    for exp in [x for x in exp_list if x.compact_hplc is not None]:
+        hplc = exp.compact_hplc.copy()
+        hplc["Sample"] = hplc["Sample"].cat.rename_categories(
+            lambda x: f"{exp.id}: {x}"
+        )
         hplcs.append(hplc)
 
-    for exp in [x for x in exp_list if x.fplc is not None]:
-        fplc = exp.fplc
-        fplc["Sample"] = exp.id
+    for exp in [x for x in exp_list if x.compact_fplc is not None]:
+        fplc = exp.compact_fplc.copy()
+        fplc["Sample"] = pd.Categorical.from_codes(
+            np.zeros(len(fplc), dtype=int), categories=[exp.id]
+        )
         fplcs.append(fplc)
 
     concat_exp = Experiment("concat")
+    concat_exp.rev = ",".join(str(x.rev) for x in exp_list)
+    if hplcs:
+        concat_exp.hplc = concat_tables(hplcs)
+    if fplcs:
+        concat_exp.fplc = concat_tables(fplcs)
+
+    return concat_exp
+
+
+def from_document(doc, level=None, attachments=None) -> Experiment:
+    """
+    Rebuilds an Experiment from its CouchDB document. Reads the current
+    document version and the older JSON versions.
+
+    For current documents, level picks which stored HPLC table to read
+    (see hplc_attachment). Attachment data is read from the document
+    unless given as a dict of name to bytes in attachments.
+    """
+    id = doc["_id"]
+    new_exp = Experiment(id)
+    new_exp.rev = doc.get("_rev")
+
     try:
-        concat_exp.hplc = pd.concat(hplcs)
+        logging.debug(
+            f'Current version: {new_exp.version}\nExp version: {doc["version"]}'
+        )
+
+        if doc["version"] == new_exp.version:
+            tables = {
+                "hplc": hplc_attachment(doc, level),
+                "fplc": ("fplc.npz", doc["fplc"]),
+            }
+            for name, (filename, metadata) in tables.items():
+                if metadata is None:
+                    continue
+                if attachments is not None:
+                    data = attachments[filename]
+                else:
+                    data = base64.b64decode(doc["_attachments"][filename]["data"])
+                setattr(new_exp, name, decode_table(data, metadata))
+
+            return new_exp
+
+        elif doc["version"] == 4:
+            logging.info(
+                f"{id} is a v4 Experiment. Perform db migration to speed up loading."
+            )
+            new_exp.hplc = pd.read_json(StringIO(doc["hplc"])).melt(
+                id_vars=["mL", "Channel", "Time", "Normalization"],
+                var_name="Sample",
+                value_name="Value",
+            )
+
+        elif doc["version"] == 3:
+            logging.info(
+                f"{id} is a v3 Experiment. You should re-upload this Experiment."
+            )
+            new_exp.hplc = pd.read_json(StringIO(doc["hplc"]))
+
+        elif doc["version"] != new_exp.version:
+            logging.error("Out of date experiment. Perform db migration.")
+
     except ValueError:
         pass
+    except KeyError:
+        logging.error(
+            "No version number. Check experiment ID and perform db migration."
+        )
 
     try:
-        concat_exp.fplc = pd.concat(fplcs)
+        new_exp.fplc = pd.read_json(StringIO(doc["fplc"]))
     except ValueError:
         pass
-
-    return concat_exp
+    except KeyError:
+        new_exp.fplc = None
+
+    return new_exp
+
+
+def pack_experiment(exp) -> bytes:
+    """
+    The whole experiment as one uncompressed npz, for local caches where
+    loading quickly matters more than size. Unlike pickles, these can be
+    loaded without trusting whoever wrote them.
+    """
+    arrays = {}
+    metadata = {
+        "id": exp.id,
+        "rev": exp.rev,
+        "version": exp.version,
+        "levels": list(exp.levels),
+    }
+    for name, table in [("hplc", exp.compact_hplc), ("fplc", exp.compact_fplc)]:
+        if table is None:
+            metadata[name] = None
+            continue
+        table_data, metadata[name] = table_arrays(table, f"{name}/")
+        arrays.update(table_data)
+
+    arrays["metadata"] = np.frombuffer(json.dumps(metadata).encode(), dtype=np.uint8)
+    buffer = BytesIO()
+    np.savez(buffer, **arrays)
+
+    return buffer.getvalue()
+
+
+def unpack_experiment(data: bytes) -> Experiment:
+    with np.load(BytesIO(data), allow_pickle=False) as arrays:
+        metadata = json.loads(arrays["metadata"].tobytes())
+        exp = Experiment(metadata["id"])
+        exp.rev = metadata["rev"]
+        exp.version = metadata["version"]
+        exp.levels = tuple(metadata["levels"])
+        for name in ["hplc", "fplc"]:
+            if metadata[name] is not None:
+                table = arrays_table(arrays, metadata[name], f"{name}/")
+                setattr(exp, f"_{name}", table)
+
+    return exp
+
+
+def upgrade_document(doc) -> dict:
+    # the same document (and revision), rewritten in the current version
+    new_doc = from_document(doc).to_document()
+    new_doc["_rev"] = doc["_rev"]
+    return new_doc
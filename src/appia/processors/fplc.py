@@ -1,14 +1,67 @@
 import pandas as pd
+import numpy as np
 import os
 import logging
 from appia.parsers.user_settings import appia_settings
-from appia.processors.core import normalizer
+from appia.processors.core import normalize_groups, read_delimited, FileSniff
+
+
+def fraction_table(fraction_marks) -> pd.DataFrame:
+    """
+    Interval table for a run's fraction marks. Fraction n covers
+    Start < mL <= End. Fraction 1 is everything before the first mark
+    and the last fraction runs to the end of the trace.
+    """
+    marks = np.asarray(fraction_marks, dtype=np.float64)
+    return pd.DataFrame(
+        {
+            "Fraction": np.arange(1, len(marks) + 2),
+            "Start": np.concatenate([[-np.inf], marks]),
+            "End": np.concatenate([marks, [np.inf]]),
+        }
+    )
+
+
+def assign_fractions(ml, fraction_marks) -> np.ndarray:
+    # the fraction is one more than the number of marks we've passed.
+    # Marks are logged in run order, so they are already sorted.
+    return np.searchsorted(np.asarray(fraction_marks), ml, side="left") + 1
+
+
+def trace_fraction_table(trace: pd.DataFrame) -> pd.DataFrame:
+    """
+    Rebuilds the fraction interval table from one processed trace, for
+    data which no longer has the original marks (e.g., from the database).
+    """
+    ends = trace.groupby("Fraction", sort=True)["mL"].max()
+    return pd.DataFrame(
+        {
+            "Fraction": ends.index.to_numpy(),
+            "Start": np.concatenate([[-np.inf], ends.to_numpy()[:-1]]),
+            "End": ends.to_numpy(),
+        }
+    )
+
+
+def fraction_slices(ml, table: pd.DataFrame) -> dict:
+    """
+    Row slices of an mL-sorted trace for each fraction in the table, found
+    by binary search rather than filtering the trace once per fraction.
+    """
+    starts = np.searchsorted(ml, table["Start"].to_numpy(), side="right")
+    stops = np.searchsorted(ml, table["End"].to_numpy(), side="right")
+
+    return {
+        fraction: slice(start, stop)
+        for fraction, start, stop in zip(table["Fraction"], starts, stops)
+    }
 
 
 class FplcProcessor(object):
     """
     The parent processor for all Appia FPLC processing. Any
-    FPLC processors should inherit from this class.
+    FPLC processors should inherit from this class. See HplcProcessor
+    for a description of the methods.
     """
 
     def __init__(self, filename, **kwargs):
@@ -22,11 +75,16 @@ class FplcProcessor(object):
         self._column_volume = kwargs.get("fplc_cv")
         self.__dict__.update(**kwargs)
 
-        if self.claim_file(filename):
-            logging.debug(f"{self.manufacturer} claims {filename}")
+        self.claim_reason = kwargs.get("claim_reason")
+        if self.claim_reason is None:
+            self.claim_reason = self.claim_sniff(FileSniff(filename))
+
+        if self.claim_reason is not None:
+            logging.debug(f"{self.manufacturer} claims {filename}: {self.claim_reason}")
             self.claimed = True
             self.prepare_sample()
-            self.process_file()
+            if not kwargs.get("defer_processing"):
+                self.process_file()
         else:
             self.claimed = False
 
@@ -59,9 +117,19 @@ class FplcProcessor(object):
 
         return cv
 
+    extensions = ()
+
     @classmethod
-    def claim_file(cls, filename):
-        pass
+    def claim_file(cls, filename) -> bool:
+        return cls.claim_sniff(FileSniff(filename)) is not None
+
+    @classmethod
+    def claim_sniff(cls, sniff):
+        # processors written before claim_sniff only override claim_file
+        if cls.claim_file.__func__ is not FplcProcessor.claim_file.__func__:
+            if cls.claim_file(sniff.filename):
+                return f"{cls.__name__}.claim_file"
+        return None
 
     def prepare_sample(self):
         pass
@@ -69,9 +137,26 @@ class FplcProcessor(object):
     def process_file(self):
         pass
 
+    def resolve_user_input(self):
+        # column_volume does not cache a prompted answer, so keep it here
+        self._column_volume = self.column_volume
+
     @property
-    def df(self) -> pd.DataFrame:
+    def compact(self) -> pd.DataFrame:
+        # one row per point, with Signal and Normalized side by side
         return self._df[
+            ["mL", "CV", "Channel", "Fraction", "Sample", "Signal", "Normalized"]
+        ]
+
+    @property
+    def df(self) -> pd.DataFrame:
+        df = self._df.melt(
+            id_vars=["mL", "CV", "Channel", "Fraction", "Sample"],
+            value_vars=["Signal", "Normalized"],
+            var_name="Normalization",
+            value_name="Value",
+        )
+        return df[
             ["mL", "CV", "Channel", "Fraction", "Sample", "Normalization", "Value"]
         ]
 
@@ -83,47 +168,30 @@ class FplcProcessor(object):
 
 
 class AktaProcessor(FplcProcessor):
+    extensions = (".csv",)
+
     def __init__(self, filename, **kwargs):
         super().__init__(filename, manufacturer="AKTA", **kwargs)
 
     @classmethod
-    def claim_file(cls, filename) -> bool:
-        if filename[-4:].lower() != ".csv":
-            return False
+    def claim_sniff(cls, sniff):
+        if sniff.extension != ".csv":
+            return None
 
-        try:
-            with open(filename, "r", encoding="utf-16") as f:
-                line = f.readline().rstrip()
-        except UnicodeDecodeError:
-            return False
+        line = sniff.first_line("utf-16")
+        if line is None:
+            return None
 
-        if line.split()[0] == "Chrom.1":
-            return True
-        else:
-            return False
+        if line.split()[:1] == ["Chrom.1"]:
+            return "first cell of UTF-16 text is Chrom.1"
 
     def prepare_sample(self):
         return super().prepare_sample()
 
     def process_file(self):
-        try:
-            fplc_trace = pd.read_csv(
-                self.filename,
-                skiprows=1,
-                header=[1],
-                encoding="utf-16-le",
-                delimiter="\t",
-                engine="python",
-            )
-        except UnicodeDecodeError:
-            fplc_trace = pd.read_csv(
-                self.filename,
-                skiprows=1,
-                header=[1],
-                encoding="utf-8",
-                delimiter=",",
-                engine="python",
-            )
+        # UNICORN writes UTF-16 TSVs, but newer versions can also export
+        # UTF-8 CSVs. read_delimited works out which from the file itself.
+        fplc_trace = read_delimited(self.filename, skiprows=1, header=[1])
 
         # The AKTA exports data with several different ml columns, each with their
         # own name (like ml.2, ml.3, etc.). These are mL axes for each channel.
@@ -154,14 +222,14 @@ class AktaProcessor(FplcProcessor):
             channels.append(channel)
         df = pd.concat(channels, ignore_index=True)
 
-        df["Fraction"] = 1
-        frac_mL = fplc_trace["mL_Fraction"].dropna()
-        for i in range(len(frac_mL)):
-            # The +2 here is a magic number. For whatever reason, the fractions
-            # generated by this method were off by two from those displayed in
-            # the AKTA software. And since those are where your protein actually
-            # ends up, it's pretty important that everything matches.
-            df.loc[df["mL"] > frac_mL[i], "Fraction"] = i + 2
+        # Points past the ith mark get fraction i + 2. The +2 is a magic number.
+        # For whatever reason, the fractions generated by this method were off
+        # by two from those displayed in the AKTA software. And since those are
+        # where your protein actually ends up, it's pretty important that
+        # everything matches.
+        frac_mL = fplc_trace["mL_Fraction"].dropna().to_numpy()
+        df["Fraction"] = assign_fractions(df["mL"].to_numpy(), frac_mL)
+        self.fraction_table = fraction_table(frac_mL)
 
         df["CV"] = df["mL"] / self.column_volume
 
@@ -169,12 +237,5 @@ class AktaProcessor(FplcProcessor):
         # filter out washes
         df = df.loc[(df.CV >= 0) & (df.CV <= 1)]
 
-        df = df.groupby(["Channel", "Sample"], group_keys=False).apply(normalizer)
-        df = df.melt(
-            id_vars=["mL", "CV", "Channel", "Fraction", "Sample"],
-            value_vars=["Signal", "Normalized"],
-            var_name="Normalization",
-            value_name="Value",
-        )
-
+        df = normalize_groups(df, ["Channel", "Sample"])
         self.df = df
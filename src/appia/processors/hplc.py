@@ -1,13 +1,46 @@
 import pandas as pd
 import numpy as np
+import csv
 from io import StringIO
 import os
+import mmap
+import locale
 import logging
 import re
-from appia.processors.core import normalizer
+import warnings
+from appia.processors.core import normalize_groups, read_delimited, FileSniff
 from appia.parsers.user_settings import appia_settings
 
 
+def parse_numbers(data: bytes, count: int, filename, dtype=np.float64) -> np.ndarray:
+    """
+    Parses count whitespace-separated numbers from data in C. numpy stops
+    at the first token that isn't a number, so reading any other count
+    means the file is malformed, and the ValueError names it.
+    """
+    try:
+        with warnings.catch_warnings():
+            # numpy warns (or, from 2.0, raises) when it stops early
+            warnings.simplefilter("ignore", DeprecationWarning)
+            values = np.fromstring(data, dtype=dtype, sep=" ")
+    except ValueError:
+        values = None
+
+    if values is None or values.size != count:
+        read = "unparseable" if values is None else f"{values.size} values"
+        raise ValueError(f"Expected {count} values in {filename} but read {read}")
+
+    return values
+
+
+def count_lines(data: bytes) -> int:
+    # lines holding anything, whichever line endings the file uses
+    data = data.strip()
+    if not data:
+        return 0
+    return data.count(b"\n") + data.count(b"\r") - data.count(b"\r\n") + 1
+
+
 class HplcProcessor(object):
     """
     The parent processor for all Appia HPLC processing. Any
@@ -18,13 +51,27 @@ class HplcProcessor(object):
     df:         This attribute should return the standard dataframe.
                 Implementation of this is left to each processor, since
                 some manufacturers use multiple channels per file, etc.
-    claim_file: this class method should return True if the processor
-                thinks it is capable of processing a file and False otherwise
+                Processors set it to a compact table (Signal and
+                Normalized columns), and reading it gives the long format.
+    compact:    the compact table, which is what Experiments store
+    extensions: file extensions (lowercase, with the dot) the processor
+                may claim. The registry only offers a file to processors
+                which list its extension, or which list none.
+    claim_sniff: this class method is given a FileSniff (extension and
+                the first few KB of the file) and should return a short
+                reason string if the processor thinks it is capable of
+                processing the file and None otherwise
+    claim_file: convenience wrapper around claim_sniff for a filename.
+                Older processors override this instead of claim_sniff,
+                which then calls it.
     prepare_sample: this method is called during __init__, and should
                 collect all information about the sample necessary to
                 process the actual trace data
     process_file: this method is calle during __init__ after prepare_sample()
                 and should produce the dataframe
+    resolve_user_input: answer every interactive prompt process_file()
+                would otherwise raise, so that a processor created with
+                defer_processing=True can finish in a worker process
     """
 
     def __init__(self, filename, **kwargs):
@@ -45,17 +92,33 @@ class HplcProcessor(object):
         self.set_name = None
         self.__dict__.update(**kwargs)
 
-        if self.claim_file(filename):
-            logging.debug(f"{self.manufacturer} claims {filename}")
+        # the registry has usually decided this already
+        self.claim_reason = kwargs.get("claim_reason")
+        if self.claim_reason is None:
+            self.claim_reason = self.claim_sniff(FileSniff(filename))
+
+        if self.claim_reason is not None:
+            logging.debug(f"{self.manufacturer} claims {filename}: {self.claim_reason}")
             self.claimed = True
             self.prepare_sample()
-            self.process_file()
+            if not kwargs.get("defer_processing"):
+                self.process_file()
         else:
             self.claimed = False
 
+    extensions = ()
+
     @classmethod
-    def claim_file(cls, filename):
-        pass
+    def claim_file(cls, filename) -> bool:
+        return cls.claim_sniff(FileSniff(filename)) is not None
+
+    @classmethod
+    def claim_sniff(cls, sniff):
+        # processors written before claim_sniff only override claim_file
+        if cls.claim_file.__func__ is not HplcProcessor.claim_file.__func__:
+            if cls.claim_file(sniff.filename):
+                return f"{cls.__name__}.claim_file"
+        return None
 
     def prepare_sample(self):
         pass
@@ -63,6 +126,10 @@ class HplcProcessor(object):
     def process_file(self):
         pass
 
+    def resolve_user_input(self):
+        # the flow rate property prompts and then caches its answer
+        _ = self.flow_rate
+
     @property
     def flow_rate(self) -> float:
         logging.debug(
@@ -118,10 +185,21 @@ class HplcProcessor(object):
         else:
             self._flow_rate = float(in_flow_rate)
 
+    @property
+    def compact(self) -> pd.DataFrame:
+        # one row per point, with Signal and Normalized side by side
+        return self._df[["Time", "mL", "Channel", "Sample", "Signal", "Normalized"]]
+
     @property
     def df(self) -> pd.DataFrame:
+        df = self._df.melt(
+            id_vars=["mL", "Sample", "Channel", "Time"],
+            value_vars=["Signal", "Normalized"],
+            var_name="Normalization",
+            value_name="Value",
+        )
         # put the columns in a standard order
-        return self._df[["Time", "mL", "Channel", "Sample", "Normalization", "Value"]]
+        return df[["Time", "mL", "Channel", "Sample", "Normalization", "Value"]]
 
     @df.setter
     def df(self, in_df: pd.DataFrame):
@@ -141,53 +219,80 @@ class HplcProcessor(object):
 
 
 class WatersProcessor(HplcProcessor):
+    extensions = (".arw",)
+    line_ending = re.compile(rb"\r\n|\r|\n")
+
     def __init__(self, filename: str, **kwargs):
         super().__init__(filename, manufacturer="Waters", **kwargs)
 
     @classmethod
-    def claim_file(cls, filename) -> bool:
-        return filename[-4:].lower() == ".arw"
+    def claim_sniff(cls, sniff):
+        if sniff.extension == ".arw":
+            return "extension is .arw"
+
+    @staticmethod
+    def parse_header(header_lines) -> dict:
+        # two tab-separated, quoted lines: field names and sample values
+        names, values = list(csv.reader(header_lines, delimiter="\t"))[:2]
+        return dict(zip(names, values))
+
+    @classmethod
+    def read_header(cls, filename) -> dict:
+        """
+        Sample metadata from the two header lines of an .arw, without
+        reading the trace. Waters ends lines with a bare carriage return,
+        which universal newlines handles.
+        """
+        with open(filename, "r") as f:
+            return cls.parse_header([f.readline(), f.readline()])
 
     def prepare_sample(self) -> None:
-        sample_info = pd.read_csv(
-            self.filename, delim_whitespace=True, nrows=2, dtype=str
+        # the only time we open the file. The trace is kept as raw bytes
+        # until process_file decodes it.
+        with open(self.filename, "rb") as f:
+            contents = f.read()
+
+        header_end = 0
+        for _ in range(2):
+            line_end = WatersProcessor.line_ending.search(contents, header_end)
+            header_end = len(contents) if line_end is None else line_end.end()
+
+        sample_info = WatersProcessor.parse_header(
+            StringIO(contents[:header_end].decode(), newline=None)
         )
-        self.sample_name = str(sample_info.loc[0]["SampleName"])
-        self.channel = re.sub("2475Ch[A-D] ", "", str(sample_info.loc[0]["Channel"]))
-        self.set_name = str(sample_info.loc[0].get("Sample Set Name"))
-        self.method = str(sample_info.loc[0].get("Instrument Method Name"))
+        self._trace = contents[header_end:]
+
+        self.sample_name = str(sample_info["SampleName"])
+        self.channel = re.sub("2475Ch[A-D] ", "", str(sample_info["Channel"]))
+        self.set_name = str(sample_info.get("Sample Set Name"))
+        self.method = str(sample_info.get("Instrument Method Name"))
 
     def process_file(self) -> None:
-        df = pd.read_csv(
-            self.filename,
-            delim_whitespace=True,
-            skiprows=2,
-            names=["Time", "Signal"],
-            header=None,
-            dtype={"Time": np.float32, "Signal": np.float32},
-        )
+        # a time/signal pair per line, parsed in C
+        trace = parse_numbers(
+            self._trace, 2 * count_lines(self._trace), self.filename, np.float32
+        ).reshape(-1, 2)
+        self._trace = None
+
+        df = pd.DataFrame({"Time": trace[:, 0], "Signal": trace[:, 1]})
         df["mL"] = df["Time"] * super().flow_rate
         df["Sample"] = self.sample_name
         df["Channel"] = self.channel
-        df = df.groupby(["Sample", "Channel"], group_keys=False).apply(normalizer)
-        df = df.melt(
-            id_vars=["mL", "Sample", "Channel", "Time"],
-            value_vars=["Signal", "Normalized"],
-            var_name="Normalization",
-            value_name="Value",
-        )
-
+        df = normalize_groups(df, ["Sample", "Channel"])
         self.df = df
 
 
 class OldShimProcessor(HplcProcessor):
+    extensions = (".asc",)
+
     def __init__(self, filename, **kwargs):
         self.channel_dict = kwargs.get("channel_mapping", [])
         super().__init__(filename, manufacturer="Shimadzu", **kwargs)
 
     @classmethod
-    def claim_file(cls, filename: str) -> bool:
-        return filename[-4:].lower() == ".asc"
+    def claim_sniff(cls, sniff):
+        if sniff.extension == ".asc":
+            return "extension is .asc"
 
     @property
     def channel_dict(self) -> dict:
@@ -213,67 +318,170 @@ class OldShimProcessor(HplcProcessor):
             raise ValueError
 
     def prepare_sample(self) -> None:
-        with open(self.filename, "r") as f:
-            lines = [x.rstrip() for x in f]
-
-        line = lines.pop(0)
-        while ":" in line:
-            line = line.split("\t")
-
-            if line[0] == "Sample ID:":
-                self.sample_name = line[1]
-            elif line[0] == "Method:":
-                self.method = line[1].split("\\")[-1]
-            elif line[0] == "Acquisition Date and Time:":
-                self.set_name = line[1].split()[0]
-            elif line[0] == "Sampling Rate:":
-                # final entry in line is the units
-                self.sampling_rate = [float(x) for x in line[1:-1]]
-            elif line[0] == "Total Data Points:":
-                self.data_points = [int(x) for x in line[1:-1]]
-
-            line = lines.pop(0)
-
-        # the rest of the lines are just signal reads, but we
-        # need to add it to the one we've already read into
-        # the `line` var.
-        self.signal_column = [float(line)]
-        self.signal_column.extend([float(x) for x in lines])
+        # The header is a few dozen "Key:\tvalue" lines, followed by one
+        # signal value per line for each channel in turn. Only the header
+        # is read here, and process_file (which may run in a worker) hands
+        # the numbers to numpy without making Python floats.
+        encoding = locale.getpreferredencoding(False)
+        with open(self.filename, "rb") as f:
+            data_start = f.tell()
+            line = f.readline()
+            while b":" in line:
+                line = line.decode(encoding).rstrip().split("\t")
+
+                if line[0] == "Sample ID:":
+                    self.sample_name = line[1]
+                elif line[0] == "Method:":
+                    self.method = line[1].split("\\")[-1]
+                elif line[0] == "Acquisition Date and Time:":
+                    self.set_name = line[1].split()[0]
+                elif line[0] == "Sampling Rate:":
+                    # final entry in line is the units
+                    self.sampling_rate = [float(x) for x in line[1:-1]]
+                elif line[0] == "Total Data Points:":
+                    self.data_points = [int(x) for x in line[1:-1]]
+
+                data_start = f.tell()
+                line = f.readline()
+
+        self.data_start = data_start
 
     def process_file(self) -> None:
-        time_column = []
-        for i in range(len(self.data_points)):
-            time_column.extend(
-                [x * self.sampling_rate[i] for x in range(self.data_points[i])]
+        with open(self.filename, "rb") as f:
+            f.seek(self.data_start)
+            signal_column = parse_numbers(
+                f.read(), sum(self.data_points), self.filename
             )
 
-        channel_column = []
-        for i in range(len(self.data_points)):
-            channel_column.extend(["ABCDEFG"[i]] * self.data_points[i])
+        data_points = np.array(self.data_points, dtype=np.int64)
+        channel_starts = np.cumsum(data_points) - data_points
+
+        # point number within its own channel, times that channel's rate
+        point_number = np.arange(data_points.sum()) - np.repeat(
+            channel_starts, data_points
+        )
+        time_column = point_number * np.repeat(self.sampling_rate, data_points)
+        channel_column = np.repeat(
+            np.array(list("ABCDEFG"[: len(data_points)]), dtype=object), data_points
+        )
 
         df = pd.DataFrame(
             {
                 "Time": time_column,
                 "Sample": self.sample_name,
                 "Channel": channel_column,
-                "Signal": self.signal_column,
+                "Signal": signal_column,
             }
         )
         df["mL"] = df.Time * super().flow_rate
         logging.debug(self.channel_dict)
         df = df.replace({"Channel": self.channel_dict})
-        df = df.groupby(["Sample", "Channel"], group_keys=False).apply(normalizer)
-        df = df.melt(
-            id_vars=["mL", "Sample", "Channel", "Time"],
-            value_vars=["Signal", "Normalized"],
-            var_name="Normalization",
-            value_name="Value",
-        )
-
+        df = normalize_groups(df, ["Sample", "Channel"])
         self.df = df
 
 
+class ShimadzuSections(object):
+    """
+    Index of the [Section]s in a LabSolutions text export. One pass over
+    the file records the byte range of every section. Metadata sections
+    are decoded the first time they are asked for, and chromatograms are
+    parsed from their byte range straight into a numpy array, so the
+    chromatograms of detectors we drop are never decoded at all.
+
+    Only offsets and small metadata are kept, so this pickles cheaply
+    when the processor is sent to a worker process.
+    """
+
+    header_pattern = re.compile(rb"^\[(.*)\]", re.MULTILINE)
+    # LabSolutions puts the R.Time column header within this many
+    # lines of the start of a chromatogram
+    chromatogram_header_lines = 15
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.encoding = locale.getpreferredencoding(False)
+        self.offsets = {}
+        self._lines = {}
+        self._chromatogram_headers = {}
+
+        with open(filename, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                headers = list(ShimadzuSections.header_pattern.finditer(buffer))
+                ends = [x.start() for x in headers[1:]] + [len(buffer)]
+                for header, end in zip(headers, ends):
+                    name = header.group(1).decode(self.encoding).strip()
+                    start = buffer.find(b"\n", header.end()) + 1
+                    # a header on the last line without a newline is empty
+                    start = end if start == 0 else min(start, end)
+                    # repeated section names are read as one section
+                    self.offsets.setdefault(name, []).append((start, end))
+
+    def names(self) -> list:
+        return list(self.offsets.keys())
+
+    def read_range(self, start: int, end: int) -> bytes:
+        with open(self.filename, "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def read(self, name: str) -> bytes:
+        return b"".join(self.read_range(*x) for x in self.offsets[name])
+
+    def lines(self, name: str) -> list:
+        if name not in self._lines:
+            text = self.read(name).decode(self.encoding)
+            # same universal newlines we'd get iterating over open()
+            self._lines[name] = list(StringIO(text, newline=None))
+        return self._lines[name]
+
+    def _find_chromatogram_header(self, name):
+        start, end = self.offsets[name][0]
+        header = []
+        data_start = None
+
+        with open(self.filename, "rb") as f:
+            f.seek(start)
+            while f.tell() < end and len(header) < self.chromatogram_header_lines:
+                line = f.readline().decode(self.encoding)
+                if "R.Time" in line:
+                    data_start = f.tell()
+                    break
+                header.append(line)
+
+        self._chromatogram_headers[name] = (header, data_start)
+
+    def chromatogram_header(self, name: str) -> list:
+        if name not in self._chromatogram_headers:
+            self._find_chromatogram_header(name)
+        return self._chromatogram_headers[name][0]
+
+    def chromatogram(self, name: str) -> np.ndarray:
+        """
+        Returns the chromatogram as a two-column (time, signal) array.
+        Raises ValueError if the section has no R.Time column header, or
+        doesn't hold as many points as its header (or its lines) say.
+        """
+        if name not in self._chromatogram_headers:
+            self._find_chromatogram_header(name)
+        data_start = self._chromatogram_headers[name][1]
+
+        if data_start is None:
+            raise ValueError(f"No R.Time column header in [{name}]")
+
+        data = self.read_range(data_start, self.offsets[name][0][1])
+        num_points = count_lines(data)
+        for line in self._chromatogram_headers[name][0]:
+            if line.startswith("# of Points"):
+                num_points = int(line.split("\t")[1])
+
+        return parse_numbers(
+            data, 2 * num_points, f"[{name}] of {self.filename}"
+        ).reshape(-1, 2)
+
+
 class NewShimProcessor(HplcProcessor):
+    extensions = (".txt",)
+
     def __init__(self, filename, **kwargs):
         if not hasattr(NewShimProcessor, "prefer_detector"):
             # this attribute is used to pick detectors for channels that have
@@ -283,32 +491,18 @@ class NewShimProcessor(HplcProcessor):
         super().__init__(filename, manufacturer="Shimadzu", **kwargs)
 
     @classmethod
-    def claim_file(cls, filename: str) -> bool:
-        if filename[-4:].lower() != ".txt":
-            return False
+    def claim_sniff(cls, sniff):
+        if sniff.extension != ".txt":
+            return None
 
-        with open(filename, "r") as f:
-            first_line = f.readline().rstrip()
-
-        return first_line == "[Header]"
+        if sniff.first_line() == "[Header]":
+            return "first line is [Header]"
 
     def prepare_sample(self) -> None:
-        # parse file into its constituent tables
-        with open(self.filename, "r") as f:
-            tables = {}
-            curr_table = False
-            for line in f:
-                table_header_match = re.match(r"\[(.*)\]", line)
-                if table_header_match:
-                    curr_table = table_header_match.group(1).strip()
-                else:
-                    if curr_table not in tables:
-                        tables[curr_table] = [line]
-                    else:
-                        tables[curr_table].append(line)
+        self.sections = ShimadzuSections(self.filename)
 
         # get sample name
-        for line in tables["Sample Information"]:
+        for line in self.sections.lines("Sample Information"):
             if "Sample Name" in line:
                 try:
                     self.sample_name = line.strip().split("\t")[1]
@@ -334,7 +528,7 @@ class NewShimProcessor(HplcProcessor):
             self.sample_name = input()
 
         # Get sample set name
-        for line in tables["Original Files"]:
+        for line in self.sections.lines("Original Files"):
             if "Method File" in line:
                 try:
                     method_path = line.strip().split("\t")[1]
@@ -358,18 +552,19 @@ class NewShimProcessor(HplcProcessor):
                         set_name = input()
                     self.set_name = set_name
 
-        # Get all chromatograms
+        # Get all chromatograms. Only their section names are kept
+        # here; the data is not read until process_file.
         self.chroms = {}
-        for key in tables:
+        for key in self.sections.names():
             if re.match("LC Chromatogram", key):
                 chrom_channel = re.search(r"Chromatogram\((.*?)\)", key)
-                self.chroms[chrom_channel.group(1)] = tables[key]
+                self.chroms[chrom_channel.group(1)] = key
 
         # Get detectors and channels
         # - First, read through the config table to get detector
         # - default channel names.
 
-        for line in tables["Configuration"]:
+        for line in self.sections.lines("Configuration"):
             if "Detector ID" in line:
                 detectors = line.strip().split("\t")[1:]
             elif "Detector Name" in line:
@@ -385,19 +580,15 @@ class NewShimProcessor(HplcProcessor):
         # . why we have to do this
 
         detector_channel_pairs = {}
-        for detector, table in self.chroms.items():
+        for detector, section in self.chroms.items():
             excitation = None
             emission = None
 
-            row_number = 0
-            line = table[row_number]
-            while "R.Time" not in line:
+            for line in self.sections.chromatogram_header(section):
                 if "Ex." in line:
                     excitation = line.rstrip().split("\t")[-1]
                 if "Em." in line:
                     emission = line.rstrip().split("\t")[-1]
-                row_number += 1
-                line = table[row_number]
 
             if excitation is not None and emission is not None:
                 channel = f"Ex:{excitation}/Em:{emission}"
@@ -481,33 +672,23 @@ class NewShimProcessor(HplcProcessor):
 
     def process_file(self) -> None:
         processed_tables = []
-        for detector, chrom in self.chroms.items():
+        for detector, section in self.chroms.items():
             # if the detector isn't in channels, that means
             # the user selected a different detector for the
-            # given channel
+            # given channel, so we never decode its data
             if detector not in self.channels:
                 continue
-            info_lines = chrom[:15]
-            info = {}
-            info_patterns = {"interval": "Interval(msec)", "num_samples": "# of Points"}
-            for key in info_patterns:
-                for line in info_lines:
-                    if re.match(info_patterns[key], line):
-                        info[key] = line.strip().split("\t")[1]
-                    elif re.match(r"R\.Time", line):
-                        skip = info_lines.index(line) + 1
 
             try:
-                df = pd.read_csv(
-                    StringIO("".join(chrom)),
-                    sep="\t",
-                    skiprows=skip,
-                    names=["Time", "Signal"],
-                )
-            except NameError:
-                # if `skip` is unbound, we should fail to read this file
-                logging.error(f"Failed to read {self.filename}")
-                return
+                chrom = self.sections.chromatogram(section)
+            except ValueError as e:
+                # without every chromatogram there is no table to give
+                logging.error(f"Failed to read {self.filename}: {e}")
+                raise
+
+            # read_csv read "-0" as an integer 0, so add 0.0 to keep
+            # negative zeros from turning up in the output
+            df = pd.DataFrame({"Time": chrom[:, 0], "Signal": chrom[:, 1] + 0.0})
 
             df["Channel"] = self.channels[detector]
             df["Sample"] = self.sample_name
@@ -516,13 +697,7 @@ class NewShimProcessor(HplcProcessor):
             processed_tables.append(df)
 
         df = pd.concat(processed_tables)
-        df = df.groupby(["Sample", "Channel"], group_keys=False).apply(normalizer)
-        df = df.melt(
-            id_vars=["mL", "Sample", "Channel", "Time"],
-            value_vars=["Signal", "Normalized"],
-            var_name="Normalization",
-            value_name="Value",
-        )
+        df = normalize_groups(df, ["Sample", "Channel"])
         self.df = df
 
 
@@ -535,6 +710,7 @@ class AgilentProcessor(HplcProcessor):
     # tricky one. Gotta use the lookahead so we don't match a
     # dot that's part of the flow.
     flow_pattern = r"_Flow([0-9]*?\.[0-9]*?)?(_|\.(?![0-9]))"
+    extensions = (".csv",)
 
     def __init__(self, filename, **kwargs):
         self._channel = kwargs.get("agilent_channel_name")
@@ -552,20 +728,21 @@ class AgilentProcessor(HplcProcessor):
         super().__init__(filename, manufacturer="Agilent", **mod_args)
 
     @classmethod
-    def claim_file(cls, filename):
-        if filename[-4:].lower() != ".csv":
-            return False
+    def claim_sniff(cls, sniff):
+        if sniff.extension != ".csv":
+            return None
 
-        with open(filename, "r", encoding="utf-16") as f:
-            line = f.readline().rstrip()
+        line = sniff.first_line("utf-16")
+        if line is None:
+            return None
 
         try:
             # if the first cell is a number, it's an
             # Agilent file. Otherwise it's not. EZPZ.
             _ = float(line.split()[0])
-            return True
-        except ValueError:
-            return False
+            return "first cell of UTF-16 text is a number"
+        except (ValueError, IndexError):
+            return None
 
     @property
     def channel(self) -> str:
@@ -601,6 +778,10 @@ class AgilentProcessor(HplcProcessor):
     def channel(self, new_channel: str) -> None:
         self._channel = str(new_channel)
 
+    def resolve_user_input(self):
+        super().resolve_user_input()
+        self.channel = self.channel
+
     def prepare_sample(self):
         just_file = os.path.split(self.filename)[1]
         self.sample_name = re.sub(
@@ -616,23 +797,10 @@ class AgilentProcessor(HplcProcessor):
             self.sample_name = self.sample_name[:-1]
 
     def process_file(self):
-        df = pd.read_csv(
-            self.filename,
-            sep="\t",
-            names=["Time", "Signal"],
-            engine="python",
-            encoding="utf-16",
-        )
+        df = read_delimited(self.filename, names=["Time", "Signal"])
         df["mL"] = df.Time * self.flow_rate
         df["Channel"] = self.channel
         df["Sample"] = self.sample_name
 
-        df = df.groupby(["Sample", "Channel"], group_keys=False).apply(normalizer)
-        df = df.melt(
-            id_vars=["mL", "Sample", "Channel", "Time"],
-            value_vars=["Signal", "Normalized"],
-            var_name="Normalization",
-            value_name="Value",
-        )
-
+        df = normalize_groups(df, ["Sample", "Channel"])
         self.df = df
@@ -0,0 +1,108 @@
+import logging
+from appia.processors import hplc, fplc
+from appia.processors.core import FileSniff
+
+ENTRY_POINT_GROUP = "appia.processors"
+
+
+def find_entry_points(group=ENTRY_POINT_GROUP):
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        # python 3.7 has no importlib.metadata, so no plugins
+        return []
+
+    found = entry_points()
+    if hasattr(found, "select"):
+        return list(found.select(group=group))
+    else:
+        return list(found.get(group, []))
+
+
+def normalize_extension(extension):
+    return "." + extension.lower().lstrip(".")
+
+
+class ProcessorRegistry(object):
+    """
+    Routes each file to the one processor that claims it.
+
+    Processors are indexed by the extensions they list, so a file is
+    only offered to processors for its extension, and the file is only
+    opened (once, through a FileSniff) if some processor wants to look.
+    Processors which list no extensions are offered every file.
+
+    Third-party processors are registered with entry points in the
+    "appia.processors" group. The entry point name is the extension,
+    optionally followed by a colon and a label so one package can
+    register several processors for one extension:
+
+        [options.entry_points]
+        appia.processors =
+            xyz = my_package.processors:XyzProcessor
+            csv:thermo = my_package.processors:ThermoProcessor
+
+    These are not imported until a file with that extension turns up.
+    """
+
+    def __init__(self, load_entry_points=True):
+        self._processors = {}
+        self._any_extension = []
+        self._pending = {}
+
+        for Proc in (
+            hplc.HplcProcessor.__subclasses__() + fplc.FplcProcessor.__subclasses__()
+        ):
+            self.register(Proc)
+
+        if load_entry_points:
+            for entry_point in find_entry_points():
+                extension = normalize_extension(entry_point.name.split(":")[0])
+                self._pending.setdefault(extension, []).append(entry_point)
+
+    def register(self, processor, extensions=None):
+        if extensions is None:
+            extensions = processor.extensions
+
+        if not extensions:
+            if processor not in self._any_extension:
+                self._any_extension.append(processor)
+            return
+
+        for extension in extensions:
+            registered = self._processors.setdefault(normalize_extension(extension), [])
+            if processor not in registered:
+                registered.append(processor)
+
+    def processors_for(self, extension):
+        extension = normalize_extension(extension)
+
+        for entry_point in self._pending.pop(extension, []):
+            try:
+                self.register(entry_point.load(), [extension])
+            except Exception as e:
+                logging.error(f"Could not load processor {entry_point.value}: {e}")
+
+        return list(
+            dict.fromkeys(self._processors.get(extension, []) + self._any_extension)
+        )
+
+    def claim(self, filename):
+        """
+        Returns a list of (processor, reason) pairs for every processor
+        which claims the file. Anything other than exactly one is a
+        problem for the caller to report.
+        """
+        sniff = None
+        claims = []
+
+        for Proc in self.processors_for(FileSniff.extension_of(filename)):
+            if sniff is None:
+                sniff = FileSniff(filename)
+
+            reason = Proc.claim_sniff(sniff)
+            if reason is not None:
+                logging.debug(f"{Proc.__name__} claims {filename}: {reason}")
+                claims.append((Proc, reason))
+
+        return claims
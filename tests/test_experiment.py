@@ -0,0 +1,327 @@
+import unittest
+from unittest import mock
+import os
+import base64
+import tempfile
+import numpy as np
+import pandas as pd
+from appia.processors import cache, core, decimate, experiment
+
+
+def fake_hplc(num_samples=3, num_points=500, seed=0):
+    rng = np.random.default_rng(seed)
+    tables = []
+    for sample in range(num_samples):
+        for channel in ["Trp", "GFP"]:
+            time = np.arange(num_points) / 60
+            peak = np.exp(-((time - rng.uniform(2, 6)) ** 2) / 0.05)
+            tables.append(
+                pd.DataFrame(
+                    {
+                        "Time": time,
+                        "mL": time * 0.5,
+                        "Sample": f"Sample {sample}",
+                        "Channel": channel,
+                        "Signal": rng.uniform(100, 1000) * peak
+                        + rng.normal(0, 1, num_points),
+                    }
+                )
+            )
+    return pd.concat(tables, ignore_index=True)
+
+
+class TestNormalization(unittest.TestCase):
+    def test_normalize_groups_matches_normalizer(self):
+        df = fake_hplc()
+        for norm_range in [None, [1, 3]]:
+            for strict in [False, True]:
+                expected = df.groupby(["Sample", "Channel"], group_keys=False).apply(
+                    lambda x: core.normalizer(x.copy(), norm_range, strict)
+                )
+                result = core.normalize_groups(
+                    df, ["Sample", "Channel"], norm_range, strict
+                )
+                pd.testing.assert_frame_equal(result, expected, check_exact=True)
+
+
+class TestCompactExperiment(unittest.TestCase):
+    def setUp(self):
+        self.exp = experiment.Experiment("test")
+        self.exp.hplc = core.normalize_groups(fake_hplc(), ["Sample", "Channel"])
+
+    def test_compact_storage(self):
+        compact = self.exp.compact_hplc
+        self.assertEqual(compact.shape[0], 3 * 2 * 500)
+        self.assertIsInstance(compact["Sample"].dtype, pd.CategoricalDtype)
+        self.assertIsInstance(compact["Channel"].dtype, pd.CategoricalDtype)
+        self.assertEqual(compact["Signal"].dtype, np.float64)
+        self.assertEqual(
+            [x for x in compact.columns if x in self.exp.hplc.columns][:4],
+            [x for x in fake_hplc().columns if x in experiment.HPLC_COLUMNS],
+        )
+
+    def test_long_round_trip(self):
+        long = self.exp.hplc
+        self.assertEqual(long.shape[0], 2 * self.exp.compact_hplc.shape[0])
+        self.assertEqual(list(long["Normalization"].unique()), ["Normalized", "Signal"])
+
+        round_trip = experiment.Experiment("round trip")
+        round_trip.hplc = long
+        pd.testing.assert_frame_equal(round_trip.compact_hplc, self.exp.compact_hplc)
+
+    def test_concat_leaves_inputs_alone(self):
+        other = experiment.Experiment("other")
+        other.hplc = self.exp.compact_hplc
+        concat = experiment.concat_experiments([self.exp, other])
+
+        self.assertEqual(
+            sorted(concat.compact_hplc["Sample"].unique()),
+            [f"{id}: Sample {i}" for id in ["other", "test"] for i in range(3)],
+        )
+        self.assertEqual(
+            sorted(self.exp.compact_hplc["Sample"].unique()),
+            ["Sample 0", "Sample 1", "Sample 2"],
+        )
+
+    def test_rename_channels(self):
+        self.exp.rename_channels({"Trp": "GFP", "GFP": "Trp"})
+        self.assertEqual(self.exp.compact_hplc.shape[0], 3 * 2 * 500)
+
+        self.exp.rename_channels({"Trp": "Both", "GFP": "Both"})
+        self.assertEqual(list(self.exp.compact_hplc["Channel"].unique()), ["Both"])
+
+    def test_wide(self):
+        wide = self.exp.compact_hplc[["Time", "Sample", "Channel", "Signal"]].copy()
+        wide["Sample"] = wide["Sample"].astype(str) + " " + wide["Channel"].astype(str)
+        expected = wide.pivot_table(index="Time", columns="Sample", values="Signal")
+
+        pd.testing.assert_frame_equal(self.exp.wide, expected, check_exact=True)
+        self.assertIs(self.exp.wide, self.exp.wide)
+
+    def test_wide_cache_invalidation(self):
+        wide = self.exp.wide
+        self.exp.renormalize_hplc([1, 3], False)
+        self.assertIsNot(self.exp.wide, wide)
+
+        self.exp.rename_channels({"Trp": "Tryptophan"})
+        self.assertIn("Sample 0 Tryptophan", self.exp.wide.columns)
+
+        wide = self.exp.wide
+
+        self.exp.scale_hplc(2)
+        pd.testing.assert_frame_equal(self.exp.wide, wide * 2)
+
+        self.exp.reduce_hplc(100)
+        self.assertTrue((self.exp.wide.count() == 100).all())
+
+    def test_wide_copies(self):
+        # copies share the wide table until their data changes
+        copy = self.exp.copy()
+        self.assertIs(copy.wide, self.exp.wide)
+
+        copy.rename_channels({"Trp": "Tryptophan"})
+        self.assertIn("Sample 0 Tryptophan", copy.wide.columns)
+        self.assertIn("Sample 0 Trp", self.exp.wide.columns)
+        self.assertIs(self.exp.copy().wide, self.exp.wide)
+
+    def test_document_round_trip(self):
+        self.exp.fplc = None
+        doc = self.exp.to_document()
+
+        self.assertEqual(doc["version"], 5)
+        self.assertIsNone(doc["fplc"])
+        self.assertEqual(list(doc["_attachments"]), ["hplc.npz"])
+
+        data = base64.b64decode(doc["_attachments"]["hplc.npz"]["data"])
+        pd.testing.assert_frame_equal(
+            experiment.decode_table(data, doc["hplc"]), self.exp.compact_hplc
+        )
+
+    def test_document_levels(self):
+        self.exp.levels = (100, 250, 1000)
+        doc = self.exp.to_document()
+
+        # 1000 points is more than the traces have, so isn't stored
+        self.assertEqual(list(doc["hplc_levels"]), ["100", "250"])
+        self.assertEqual(experiment.attachment_names(doc, 200), ["hplc-250.npz"])
+        self.assertEqual(experiment.attachment_names(doc, 300)[0], "hplc.npz")
+
+        for level, num_points in [(50, 100), (250, 250), (None, 500)]:
+            exp = experiment.from_document(doc, level)
+            sizes = exp.compact_hplc.groupby(
+                ["Sample", "Channel"], observed=True
+            ).size()
+            self.assertTrue((sizes <= num_points).all())
+            self.assertTrue((sizes > num_points * 0.9).all())
+
+    def test_pack_round_trip(self):
+        self.exp.rev = "1-abc"
+        exp = experiment.unpack_experiment(experiment.pack_experiment(self.exp))
+
+        self.assertEqual(
+            (exp.id, exp.rev, exp.levels), ("test", "1-abc", self.exp.levels)
+        )
+        pd.testing.assert_frame_equal(exp.compact_hplc, self.exp.compact_hplc)
+        self.assertIsNone(exp.compact_fplc)
+
+
+class TestDecimation(unittest.TestCase):
+    def setUp(self):
+        self.df = fake_hplc(num_points=5000)
+        # a peak a few points wide, which every-nth-point reduction misses
+        self.spike = self.df.index[(self.df["Sample"] == "Sample 1")][2501]
+        self.df.loc[self.spike, "Signal"] = 1e5
+
+    def test_methods(self):
+        for method in decimate.METHODS:
+            reduced = decimate.decimate(
+                self.df, ["Sample", "Channel"], "mL", "Signal", 200, method
+            )
+            sizes = reduced.groupby(["Sample", "Channel"]).size()
+            self.assertTrue((sizes <= 200).all())
+            self.assertTrue(reduced.index.is_monotonic_increasing)
+            self.assertIn(self.spike, reduced.index)
+
+            # every group keeps its end points
+            ends = self.df.groupby(["Sample", "Channel"])["mL"].agg(["min", "max"])
+            kept = reduced.groupby(["Sample", "Channel"])["mL"].agg(["min", "max"])
+            pd.testing.assert_frame_equal(kept, ends)
+
+    def test_short_groups_kept(self):
+        reduced = decimate.decimate(
+            self.df, ["Sample", "Channel"], "mL", "Signal", 5000, "lttb"
+        )
+        pd.testing.assert_frame_equal(reduced, self.df)
+
+    def test_reduce_hplc(self):
+        exp = experiment.Experiment("test")
+        exp.hplc = core.normalize_groups(self.df, ["Sample", "Channel"])
+        exp.reduce_hplc(500)
+
+        hplc = exp.compact_hplc
+        self.assertEqual(hplc.shape[0], 3 * 2 * 500)
+        self.assertEqual(hplc["Signal"].max(), 1e5)
+        self.assertEqual(hplc["Normalized"].max(), 1)
+
+
+class TestExperimentCache(unittest.TestCase):
+    def make_exp(self, id):
+        exp = experiment.Experiment(id)
+        exp.hplc = core.normalize_groups(fake_hplc(), ["Sample", "Channel"])
+        return exp
+
+    def test_revisions(self):
+        exp_cache = cache.ExperimentCache()
+        exp_cache.put("a", "1-abc", self.make_exp("a"))
+
+        self.assertIsNotNone(exp_cache.get("a", "1-abc"))
+        self.assertIsNone(exp_cache.get("a", "2-def"))
+        self.assertIsNone(exp_cache.get("b", "1-abc"))
+        self.assertEqual((exp_cache.hits, exp_cache.misses), (1, 2))
+
+    def test_levels(self):
+        exp_cache = cache.ExperimentCache()
+        exp_cache.put("a", "1-abc", self.make_exp("a"))
+        exp_cache.put("a", "1-abc", self.make_exp("a"), 500)
+        self.assertIsNone(exp_cache.get("a", "1-abc", 5000))
+        self.assertIsNotNone(exp_cache.get("a", "1-abc", 500))
+
+        exp_cache.discard("a")
+        self.assertEqual((len(exp_cache), exp_cache.size), (0, 0))
+
+    def test_copies(self):
+        exp_cache = cache.ExperimentCache()
+        exp_cache.put("a", "1-abc", self.make_exp("a"))
+
+        exp_cache.get("a", "1-abc").rename_channels({"Trp": "Tryptophan"})
+        self.assertEqual(
+            list(exp_cache.get("a", "1-abc").compact_hplc["Channel"].cat.categories),
+            ["GFP", "Trp"],
+        )
+
+    def test_eviction(self):
+        exp_size = self.make_exp("a").memory_usage()
+        exp_cache = cache.ExperimentCache(max_bytes=2 * exp_size)
+
+        for id in ["a", "b"]:
+            exp_cache.put(id, "1", self.make_exp(id))
+        # a is now the most recently used, so b goes first
+        exp_cache.get("a", "1")
+        exp_cache.put("c", "1", self.make_exp("c"))
+
+        self.assertEqual(len(exp_cache), 2)
+        self.assertLessEqual(exp_cache.size, exp_cache.max_bytes)
+        self.assertIsNone(exp_cache.get("b", "1"))
+        self.assertIsNotNone(exp_cache.get("a", "1"))
+
+    def test_oversized(self):
+        exp_size = self.make_exp("a").memory_usage()
+        exp_cache = cache.ExperimentCache(max_bytes=2 * exp_size)
+        exp_cache.put("a", "1", self.make_exp("a"))
+        exp_cache.put("a", "1", self.make_exp("a"), level=500)
+
+        # too big to cache, so the full data it replaces goes but level 500 stays
+        big = experiment.concat_experiments([self.make_exp(x) for x in "abc"])
+        exp_cache.put("a", "2", big)
+
+        self.assertIsNone(exp_cache.get("a", "1"))
+        self.assertIsNone(exp_cache.get("a", "2"))
+        self.assertIsNotNone(exp_cache.get("a", "1", level=500))
+        self.assertEqual(exp_cache.size, exp_size)
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.disk_cache = cache.DiskCache(self.directory.name, max_bytes=2500)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_put(self):
+        self.assertIsNone(self.disk_cache.get("a"))
+        self.disk_cache.put("a", b"some bytes")
+        self.assertEqual(self.disk_cache.get("a"), b"some bytes")
+
+        # another process on the same directory sees it
+        other = cache.DiskCache(self.directory.name)
+        self.assertEqual(other.get("a"), b"some bytes")
+        self.assertEqual(
+            os.listdir(self.directory.name),
+            [os.path.basename(self.disk_cache.path("a"))],
+        )
+
+    def test_claim(self):
+        other = cache.DiskCache(self.directory.name)
+        self.assertTrue(self.disk_cache.claim("warm a 1-abc"))
+        self.assertFalse(other.claim("warm a 1-abc"))
+        self.assertTrue(other.claim("warm a 2-def"))
+
+    def test_eviction(self):
+        for i, key in enumerate(["a", "b"]):
+            self.disk_cache.put(key, bytes(1000))
+            os.utime(self.disk_cache.path(key), (i, i))
+        # reading a makes b the least recently used
+        self.disk_cache.get("a")
+        self.disk_cache.put("c", bytes(1000))
+
+        self.assertIsNone(self.disk_cache.get("b"))
+        self.assertIsNotNone(self.disk_cache.get("a"))
+        self.assertLessEqual(self.disk_cache.size(), self.disk_cache.max_bytes)
+
+    def test_scans(self):
+        self.disk_cache.put("a", bytes(1000))
+        with mock.patch.object(
+            self.disk_cache, "entries", wraps=self.disk_cache.entries
+        ) as entries:
+            # under max_bytes, the running size is enough
+            self.disk_cache.put("b", bytes(1000))
+            self.assertEqual(entries.call_count, 0)
+
+            self.disk_cache.put("c", bytes(1000))
+            self.assertEqual(entries.call_count, 1)
+        self.assertLessEqual(self.disk_cache.size(), self.disk_cache.max_bytes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,23 @@
 import unittest
 import os
+import gc
+import tempfile
+import weakref
 from appia.processors import hplc, fplc
+from appia.processors.registry import ProcessorRegistry
 from appia.parsers import process_parser
 
 
 appia_dir = os.path.split(os.path.dirname(os.path.realpath(__file__)))[0]
 
 
+def forget_subclass(subclass):
+    # classes sit in reference cycles, so they outlive their last name
+    gc.collect()
+    if subclass() in hplc.HplcProcessor.__subclasses__():
+        raise AssertionError(f"{subclass().__name__} is still registered")
+
+
 class FakeArgs(object):
     def __init__(self, arg_dict):
         for key, val in arg_dict.items():
@@ -27,6 +38,10 @@ class TestProcessing(unittest.TestCase):
         self.assertEqual(results.channel, "ex280/em350")
         self.assertEqual(results.method, "Sup6Inc_10_300_TrpGFP_LineA")
 
+        header = hplc.WatersProcessor.read_header(waters_file)
+        self.assertEqual(header["SampleName"], "SEC_08")
+        self.assertEqual(header["Sample Set Name"], "Exp105_ENaC_SEC")
+
         df = results.df
         self.assertEqual(df.shape[0], 13202)
         self.assertEqual(df.shape[1], 6)
@@ -116,10 +131,125 @@ class TestProcessing(unittest.TestCase):
         self.assertAlmostEqual(sum(df.Value), 1062056.7151461844)
         self.assertEqual(set(df.Channel), {"mS/cm", "mAU", "%"})
 
+        # the fraction table and the Fraction column must agree
+        trace = df.loc[(df.Channel == "mAU") & (df.Normalization == "Signal")]
+        slices = fplc.fraction_slices(trace.mL.to_numpy(), results.fraction_table)
+        for fraction, frac_slice in slices.items():
+            self.assertTrue((trace.Fraction.to_numpy()[frac_slice] == fraction).all())
+        self.assertEqual(sum(x.stop - x.start for x in slices.values()), trace.shape[0])
+
         norm = df.loc[df["Normalization"] == "Normalized"]
         self.assertEqual(min(norm.Value), 0)
         self.assertEqual(max(norm.Value), 1)
 
+    def test_parallel_processing(self):
+        files = [
+            os.path.join(appia_dir, "test-files", x)
+            for x in [
+                "results1844.arw",
+                "results1845.arw",
+                "05_25_BB.asc",
+                "new-shim-1.txt",
+                "NAI-A594_0H_RT_Channel540_Flow1.0.CSV",
+                "2018_0821SEC_detergentENaC.csv",
+            ]
+        ]
+        arg_dict = {
+            "hplc_flow_rate": 0.5,
+            "fplc_cv": 24,
+            "agilent_channel_name": "test-channel",
+            "channel_mapping": ["A", "Trp", "B", "GFP"],
+        }
+
+        serial = process_parser.process_files(files, FakeArgs(arg_dict))
+        parallel = process_parser.process_files(
+            files, FakeArgs({**arg_dict, "jobs": 3})
+        )
+
+        self.assertEqual([x.filename for x in serial], [x.filename for x in parallel])
+        for s_proc, p_proc in zip(serial, parallel):
+            self.assertEqual(s_proc.df.to_csv(), p_proc.df.to_csv())
+
+    def test_registry(self):
+        registry = ProcessorRegistry(load_entry_points=False)
+        expected = {
+            "results1844.arw": hplc.WatersProcessor,
+            "05_25_BB.asc": hplc.OldShimProcessor,
+            "new-shim-1.txt": hplc.NewShimProcessor,
+            "NAI-A594_0H_RT_Channel540_Flow1.0.CSV": hplc.AgilentProcessor,
+            "2018_0821SEC_detergentENaC.csv": fplc.AktaProcessor,
+        }
+
+        for filename, Proc in expected.items():
+            claims = registry.claim(os.path.join(appia_dir, "test-files", filename))
+            self.assertEqual(len(claims), 1)
+            self.assertIs(claims[0][0], Proc)
+            self.assertIsInstance(claims[0][1], str)
+
+        self.assertEqual(registry.claim(os.path.join(appia_dir, "README.md")), [])
+
+    def test_legacy_processor(self):
+        # written before claim_sniff and extensions existed
+        class LegacyProcessor(hplc.HplcProcessor):
+            @classmethod
+            def claim_file(cls, filename):
+                return filename.endswith("legacy-trace.dat")
+
+        # registries pick up every HplcProcessor subclass, so it has to be
+        # gone before the next test builds one
+        self.addCleanup(forget_subclass, weakref.ref(LegacyProcessor))
+
+        registry = ProcessorRegistry(load_entry_points=False)
+        with tempfile.TemporaryDirectory() as directory:
+            legacy_file = os.path.join(directory, "legacy-trace.dat")
+            with open(legacy_file, "w") as f:
+                f.write("Time,Signal\n")
+
+            claims = registry.claim(legacy_file)
+            self.assertEqual([x[0] for x in claims], [LegacyProcessor])
+            self.assertTrue(LegacyProcessor(legacy_file).claimed)
+
+        # offered every file, but only claims its own
+        waters_file = os.path.join(appia_dir, "test-files", "results1844.arw")
+        self.assertEqual(
+            [x[0] for x in registry.claim(waters_file)], [hplc.WatersProcessor]
+        )
+
+
+class TestMalformedFiles(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def broken_copy(self, name, line_number):
+        # the test file with one line of its trace replaced by a word
+        with open(os.path.join(appia_dir, "test-files", name), "rb") as f:
+            lines = f.read().splitlines(True)
+        lines[line_number] = b"oops" + lines[line_number][-1:]
+
+        path = os.path.join(self.directory.name, name)
+        with open(path, "wb") as f:
+            f.writelines(lines)
+        return path
+
+    def test_old_shim(self):
+        path = self.broken_copy("05_25_BB.asc", -10)
+        with self.assertRaisesRegex(ValueError, "05_25_BB.asc"):
+            hplc.OldShimProcessor(path, hplc_flow_rate=0.5)
+
+    def test_waters(self):
+        path = self.broken_copy("results1844.arw", -10)
+        with self.assertRaisesRegex(ValueError, "results1844.arw"):
+            hplc.WatersProcessor(path, hplc_flow_rate=0.5)
+
+    def test_new_shim(self):
+        # a few points into the first chromatogram
+        path = self.broken_copy("new-shim-1.txt", 180)
+        with self.assertRaisesRegex(ValueError, "new-shim-1.txt"):
+            hplc.NewShimProcessor(path, hplc_flow_rate=0.5)
+
 
 if __name__ == "__main__":
     unittest.main()
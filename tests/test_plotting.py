@@ -0,0 +1,111 @@
+import unittest
+import base64
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from appia.plotters import trace_figure
+
+
+def decode(typed):
+    dtype = {"f8": "<f8", "f4": "<f4"}[typed["dtype"]]
+    return np.frombuffer(base64.b64decode(typed["bdata"]), dtype=dtype)
+
+
+class TestFacetFigure(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.df = pd.DataFrame(
+            {
+                "mL": np.tile(np.arange(50) / 10, 6),
+                "Sample": np.repeat([f"Sample {x}" for x in range(3)], 100),
+                "Channel": np.tile(np.repeat(["Trp", "GFP"], 50), 3),
+                "Signal": rng.uniform(0, 1, 300),
+            }
+        )
+        self.fig = trace_figure.facet_figure(
+            self.df, "mL", "Signal", "Sample", "Channel", y_range=[0, 1]
+        )
+
+    def test_traces(self):
+        data = self.fig["data"]
+        self.assertEqual(len(data), 3 * 2)
+        self.assertEqual([x["showlegend"] for x in data], [True, False] * 3)
+
+        for trace in data:
+            channel = "Trp" if trace["yaxis"] == "y2" else "GFP"
+            expected = self.df.loc[
+                (self.df["Sample"] == trace["name"]) & (self.df["Channel"] == channel)
+            ]
+            np.testing.assert_array_equal(decode(trace["x"]), expected["mL"])
+            np.testing.assert_array_equal(decode(trace["y"]), expected["Signal"])
+
+    def test_layout(self):
+        layout = self.fig["layout"]
+        # the first facet is the top row
+        self.assertEqual([x["text"] for x in layout["annotations"]], ["Trp", "GFP"])
+        self.assertGreater(layout["yaxis2"]["domain"][0], layout["yaxis"]["domain"][1])
+        self.assertEqual(layout["xaxis2"]["matches"], "x")
+        self.assertNotIn("matches", layout["yaxis2"])
+        self.assertEqual(layout["yaxis"]["range"], [0, 1])
+
+        # plotly accepts it as a figure
+        go.Figure(self.fig)
+
+    def test_custom_data(self):
+        fig = trace_figure.facet_figure(
+            self.df,
+            "mL",
+            "Signal",
+            "Sample",
+            "Channel",
+            custom_data=["Signal", "mL"],
+            trace_meta={("Sample 1", "GFP"): {"signal_min": 0}},
+        )
+        trace = fig["data"][3]
+        self.assertEqual((trace["name"], trace["yaxis"]), ("Sample 1", "y"))
+        self.assertEqual(trace["meta"], {"signal_min": 0})
+        self.assertNotIn("meta", fig["data"][2])
+
+        self.assertEqual(trace["customdata"]["shape"], "50, 2")
+        custom = decode(trace["customdata"]).reshape(50, 2)
+        np.testing.assert_array_equal(custom[:, 0], decode(trace["y"]))
+        np.testing.assert_array_equal(custom[:, 1], decode(trace["x"]))
+
+    def test_shared(self):
+        reference = pd.DataFrame(
+            {
+                "mL": np.arange(20) / 4,
+                "Sample": "Reference",
+                "Signal": np.arange(20, dtype=float),
+            }
+        )
+        fig = trace_figure.facet_figure(
+            self.df, "mL", "Signal", "Sample", "Channel", shared=reference
+        )
+        shared = [x for x in fig["data"] if x["name"] == "Reference"]
+
+        # after the other traces, once in each facet, from the same arrays
+        self.assertEqual(fig["data"][-2:], shared)
+        self.assertEqual([x["yaxis"] for x in shared], ["y2", "y"])
+        self.assertEqual([x["showlegend"] for x in shared], [True, False])
+        self.assertIs(shared[0]["x"], shared[1]["x"])
+        np.testing.assert_array_equal(decode(shared[0]["y"]), reference["Signal"])
+
+        # just the shared traces, on the axes a full figure would use
+        fig = trace_figure.facet_figure(
+            self.df.iloc[:0],
+            "mL",
+            "Signal",
+            "Sample",
+            "Channel",
+            shared=reference,
+            facets=["Trp", "GFP"],
+        )
+        self.assertEqual(
+            [(x["yaxis"], x["showlegend"], x["y"]) for x in fig["data"]],
+            [(x["yaxis"], x["showlegend"], x["y"]) for x in shared],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,19 +1,32 @@
 import dash
 import os
 import json
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dash import dcc
 from dash import html
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.utils
 import pandas as pd
 from urllib.parse import parse_qs
 from appia.processors.database import Database
-from appia.processors.experiment import concat_experiments
+from appia.processors.experiment import HPLC_LEVELS, concat_experiments
+from appia.processors.fplc import fraction_slices, trace_fraction_table
+from appia.processors.decimate import decimate
+from appia.plotters.trace_figure import facet_figure
 from appia.parsers.user_settings import appia_settings
 
 url_basename = "/traces/"
-app = dash.Dash(__name__, url_base_pathname=url_basename)
+# most experiments fetched at once for one request
+max_fetch_workers = 8
+# the graphs are made by callbacks, so aren't in the layout at startup
+app = dash.Dash(
+    __name__, url_base_pathname=url_basename, suppress_callback_exceptions=True
+)
 server = app.server
 db = Database()
 
@@ -42,13 +55,15 @@ def exp_list_from_pathname(pathname):
     return path_string.split("+")
 
 
-def get_experiments(experiment_name_list):
+def get_experiments(experiment_name_list, level=None):
     if len(experiment_name_list) == 1:
-        exp = db.pull_experiment(experiment_name_list[0].replace("%20", " "))
+        exp = db.pull_experiment(experiment_name_list[0].replace("%20", " "), level)
     else:
-        exp_list = [
-            db.pull_experiment(x.replace("%20", " ")) for x in experiment_name_list
-        ]
+        exp_list = db.pull_experiments(
+            [x.replace("%20", " ") for x in experiment_name_list],
+            max_workers=max_fetch_workers,
+            level=level,
+        )
         exp = concat_experiments(exp_list)
 
     return exp
@@ -57,94 +72,184 @@ def get_experiments(experiment_name_list):
 with open("channel_dict.json") as f:
     channel_dict = json.load(f)
 
+# points per trace sent to the browser
+web_trace_points = 1000
 
-def make_combined_table(exp):
-    if exp.fplc is not None:
-        hplc_df = exp.hplc.copy()
-        fplc_as_h = exp.fplc.loc[exp.fplc["Channel"] == "mAU"][
-            ["mL", "Sample", "Normalization", "Value"]
-        ].copy()
-        fplc_as_h["Sample"] = "Preparative: " + fplc_as_h["Sample"]
 
-        f_per_channel = []
+def view_level(num_points):
+    # the stored level to ask for, so zooming reuses a few cached levels
+    return next((x for x in HPLC_LEVELS if x >= num_points), None)
 
-        for channel in set(hplc_df["Channel"]):
-            ch_f = fplc_as_h.copy()
-            ch_f["Channel"] = channel
-            f_per_channel.append(ch_f)
 
-        fplc_as_h = pd.concat(f_per_channel)
-        hplc_df = pd.concat([hplc_df, fplc_as_h])
-    else:
-        hplc_df = exp.hplc
+def get_view_experiments(experiment_name_list, view_range=None, x_ax="mL"):
+    """
+    Experiments with enough HPLC points for web_trace_points per trace
+    across view_range. The whole trace is drawn from a reduced level, and
+    narrower views from finer levels, up to the full data.
+    """
+    exp = get_experiments(experiment_name_list, view_level(web_trace_points))
+    if view_range is None or exp.compact_hplc is None:
+        return exp
 
-    return hplc_df
+    x = exp.compact_hplc[x_ax]
+    width = abs(view_range[1] - view_range[0])
+    if width == 0:
+        return exp
 
+    num_points = web_trace_points * (x.max() - x.min()) / width
+    if num_points > web_trace_points:
+        exp = get_experiments(experiment_name_list, view_level(num_points))
 
-def get_hplc_graphs(exp, view_range=None, x_ax="mL", overlay=False, format="png"):
-    exp.rename_channels(channel_dict)
-    raw_graphs = []
+    return exp
 
-    if overlay:
-        x_ax = "mL"
-        hplc_df = make_combined_table(exp)
-    else:
-        hplc_df = exp.hplc
 
-    hplc_df.dropna(inplace=True)
+def preparative_table(exp):
+    # the preparative mAU traces, to overlay on every HPLC channel
+    if exp.compact_fplc is None:
+        return None
+
+    fplc = exp.compact_fplc
+    prep_df = fplc.loc[fplc["Channel"] == "mAU"][
+        ["mL", "Sample", "Signal", "Normalized"]
+    ].dropna(subset=["mL", "Signal"])
+    prep_df["Sample"] = "Preparative: " + prep_df["Sample"].astype(str)
+
+    return prep_df
 
-    if len(hplc_df["Sample"].unique()) > 10:
+
+def sample_colors(samples):
+    # fixed up front, since a zoomed view may not include every sample
+    if len(samples) > 10:
         disc_color_scheme = px.colors.qualitative.Alphabet
     else:
         disc_color_scheme = px.colors.qualitative.Plotly
+    return {
+        sample: disc_color_scheme[i % len(disc_color_scheme)]
+        for i, sample in enumerate(samples)
+    }
+
+
+def resample_view(
+    hplc_df,
+    x_ax,
+    view_range=None,
+    num_points=web_trace_points,
+    columns=("Sample", "Channel"),
+):
+    """
+    The points worth sending to the browser: those in (or just outside)
+    the visible range, reduced to about screen resolution per trace with
+    min-max buckets, so every peak keeps its height. Points are picked by
+    Signal, and Normalized is the same trace rescaled.
+    """
+    if view_range is not None:
+        low, high = min(view_range), max(view_range)
+        margin = (high - low) * 0.05
+        hplc_df = hplc_df.loc[hplc_df[x_ax].between(low - margin, high + margin)]
+
+    return decimate(hplc_df, list(columns), x_ax, "Signal", num_points, "minmax")
+
+
+def get_hplc_graphs(
+    exp,
+    view_range=None,
+    x_ax="mL",
+    overlay=False,
+    format="png",
+    norms=("Signal", "Normalized"),
+):
+    exp.rename_channels(channel_dict)
+    raw_graphs = []
 
-    for norm in ["Signal", "Normalized"]:
-        fig = px.line(
-            data_frame=hplc_df.loc[hplc_df["Normalization"] == norm],
-            x=x_ax,
-            y="Value",
-            color="Sample",
-            facet_row="Channel",
-            template="plotly_white",
-            color_discrete_sequence=disc_color_scheme,
-            render_mode="auto" if format != "svg" else "svg",
+    prep_df = None
+    if overlay:
+        x_ax = "mL"
+        prep_df = preparative_table(exp)
+
+    hplc_df = exp.compact_hplc.dropna(subset=[x_ax, "Signal"])
+
+    samples = list(hplc_df["Sample"].unique())
+    if prep_df is not None:
+        samples.extend(prep_df["Sample"].unique())
+    color_map = sample_colors(samples)
+
+    # the browser renormalizes analytic traces and switches them between
+    # mL and Time itself (assets/), but a zoomed view only has some of each
+    # trace, so send the minimum of the whole trace and its flow rate along
+    traces = hplc_df.groupby(["Sample", "Channel"], observed=True)
+    minimums = traces["Signal"].min()
+    # mL is Time times the flow rate, which is fixed for each trace
+    minutes_per_ml = traces["Time"].sum() / traces["mL"].sum()
+    trace_meta = {
+        key: {"signal_min": float(x), "minutes_per_ml": float(minutes_per_ml[key])}
+        for key, x in minimums.items()
+    }
+
+    hplc_df = resample_view(hplc_df, x_ax, view_range)
+    if prep_df is not None:
+        # one copy, drawn on every channel's axes
+        prep_df = resample_view(prep_df, "mL", view_range, columns=["Sample"])
+
+    for norm in norms:
+        # each channel gets its own y axis, so they aren't stuck on one range
+        fig = facet_figure(
+            hplc_df,
+            x_ax,
+            norm,
+            "Sample",
+            "Channel",
+            color_map,
+            "webgl" if format != "svg" else "svg",
+            custom_data=["Signal", "mL"] if norm == "Normalized" else (),
+            trace_meta=trace_meta,
+            shared=prep_df,
+            x_title="Time (min)" if x_ax == "Time" else None,
+            y_title="Value",
+            x_range=view_range,
+            y_range=[0, 1] if norm == "Normalized" else None,
         )
-
-        if norm == "Normalized":
-            try:
-                # without this, your channels are stuck using the same yaxis range
-                fig.layout.yaxis1.update(matches=None, range=[0, 1])
-                fig.layout.yaxis2.update(matches=None, range=[0, 1])
-                fig.layout.yaxis3.update(matches=None, range=[0, 1])
-                fig.layout.yaxis4.update(matches=None, range=[0, 1])
-            except AttributeError:
-                # if the trace only has one channel, it doesn't have yaxis2
-                pass
-        else:
-            try:
-                # without this, your channels are stuck using the same yaxis range
-                fig.layout.yaxis1.update(matches=None)
-                fig.layout.yaxis2.update(matches=None)
-                fig.layout.yaxis3.update(matches=None)
-                fig.layout.yaxis4.update(matches=None)
-            except AttributeError:
-                # if the trace only has one channel, it doesn't have yaxis2
-                pass
-
-        # remove 'Channel=' from the facet labels
-        fig.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
-
-        if x_ax == "Time":
-            fig.update_layout(xaxis_title="Time (min)")
+        # keeps legend selections and zoom when the graph is resampled
+        fig["layout"]["uirevision"] = norm
+        fig["layout"]["meta"] = {"x_axis": x_ax}
 
         raw_graphs.append(fig)
 
-        if view_range is not None:
-            fig.update_xaxes(autorange=False, range=view_range)
-
     return raw_graphs
 
 
+def preparative_traces(exp, view_range=None, format="png"):
+    """
+    The preparative traces get_hplc_graphs overlays on the Signal and
+    Normalized figures, on the same axes and in the same colors, without
+    the analytic traces, so they can be added to graphs already drawn.
+    """
+    exp.rename_channels(channel_dict)
+    hplc_df = exp.compact_hplc.dropna(subset=["mL", "Signal"])
+    prep_df = preparative_table(exp)
+
+    color_map = sample_colors(
+        list(hplc_df["Sample"].unique()) + list(prep_df["Sample"].unique())
+    )
+    # the channels with points in view, which get_hplc_graphs facets by
+    facets = pd.unique(resample_view(hplc_df, "mL", view_range)["Channel"])
+    prep_df = resample_view(prep_df, "mL", view_range, columns=["Sample"])
+
+    return {
+        norm: facet_figure(
+            hplc_df.iloc[:0],
+            "mL",
+            norm,
+            "Sample",
+            "Channel",
+            color_map,
+            "webgl" if format != "svg" else "svg",
+            shared=prep_df,
+            facets=facets,
+        )["data"]
+        for norm in ["Signal", "Normalized"]
+    }
+
+
 def get_fplc_graphs(exp, format="png"):
     fplc = exp.fplc
 
@@ -159,12 +264,18 @@ def get_fplc_graphs(exp, format="png"):
 
     if len(samples) == 1:
         fplc = fplc.loc[(fplc.Normalization == "Signal") & (fplc.Channel == "mAU")]
+        if not fplc["mL"].is_monotonic_increasing:
+            fplc = fplc.sort_values("mL", kind="stable")
+        ml = fplc["mL"].to_numpy()
+        value = fplc["Value"].to_numpy()
+
         fplc_graph = go.Figure()
-        for frac in set(fplc["Fraction"]):
+        frac_slices = fraction_slices(ml, trace_fraction_table(fplc))
+        for frac, frac_slice in frac_slices.items():
             fplc_graph.add_trace(
                 go.Scatter(
-                    x=fplc[fplc.Fraction == frac]["mL"],
-                    y=fplc[fplc.Fraction == frac]["Value"],
+                    x=ml[frac_slice],
+                    y=value[frac_slice],
                     mode="lines",
                     fill="tozeroy",
                     visible="legendonly",
@@ -172,10 +283,12 @@ def get_fplc_graphs(exp, format="png"):
                     name=f"Fraction {frac}",
                 )
             )
+        # the fractions stay svg for their fill, and setRenderMode leaves them
+        overall = go.Scatter if format == "svg" else go.Scattergl
         fplc_graph.add_trace(
             # want the overall FPLC curve as a separate trace so that it stays present
             # to give overall sense of quality of trace
-            go.Scatter(
+            overall(
                 x=fplc["mL"],
                 y=fplc["Value"],
                 mode="lines",
@@ -185,43 +298,129 @@ def get_fplc_graphs(exp, format="png"):
                 line={"color": "black"},
             )
         )
+        fplc_graph.update_layout(
+            template="plotly_white",
+            xaxis_title="Retention Volume (mL)",
+            yaxis_title="Signal",
+        )
     else:
         fplc = fplc.loc[(fplc.Channel == "mAU")]
-        fplc_graph = px.line(
-            data_frame=fplc,
-            x="mL",
-            y="Value",
-            color="Sample",
-            facet_row="Normalization",
-            hover_data=["Value", "mL", "Fraction"],
-            template="plotly_white",
-            render_mode="auto" if format != "svg" else "svg",
+        fplc = decimate(
+            fplc, ["Sample", "Normalization"], "mL", "Value", web_trace_points
+        )
+        fplc_graph = facet_figure(
+            fplc,
+            "mL",
+            "Value",
+            "Sample",
+            "Normalization",
+            render_mode="webgl" if format != "svg" else "svg",
+            hover_data=["Fraction"],
+            x_title="Retention Volume (mL)",
+            y_title="Signal",
         )
-        try:
-            fplc_graph.layout.yaxis2.update(matches=None)
-        except AttributeError:
-            pass
-        # remove 'Channel=' from the facet labels
-        fplc_graph.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
-
-    fplc_graph.update_layout(template="plotly_white")
-    fplc_graph.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
 
-    fplc_graph.update_layout(xaxis_title="Retention Volume (mL)", yaxis_title="Signal")
     return fplc_graph
 
 
-def get_plotly(exp, view_range=None, x_ax="mL", format_val="png", overlay=False):
+# built figures, least recently used first
+figure_cache = OrderedDict()
+figure_cache_lock = threading.Lock()
+max_cached_figures = 64
+
+
+def cached_figure(key, build):
+    """
+    The figure cached under key, or a new one from build(). Keys hold
+    everything the figure depends on, including document revisions, so
+    entries never need invalidating and just age out. Figures are also
+    kept as JSON in the database's disk cache, if it has one, so other
+    workers can use them.
+    """
+    with figure_cache_lock:
+        fig = figure_cache.get(key)
+        if fig is not None:
+            figure_cache.move_to_end(key)
+            return fig
+
+    disk_key = f"figure {key!r}"
+    data = None if db.disk_cache is None else db.disk_cache.get(disk_key)
+    if data is not None:
+        fig = json.loads(data)
+    else:
+        fig = build()
+        if db.disk_cache is not None:
+            data = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+            db.disk_cache.put(disk_key, data.encode("utf-8"))
+
+    with figure_cache_lock:
+        figure_cache[key] = fig
+        while len(figure_cache) > max_cached_figures:
+            figure_cache.popitem(last=False)
+
+    return fig
+
+
+def cached_hplc_figures(
+    exp, view_range, x_ax, format_val, overlay, norm_range, exp_key
+):
+    # the Signal and Normalized figures, from figure_cache if possible
+    render_mode = "svg" if format_val == "svg" else "auto"
+    if view_range is not None:
+        view_range = tuple(view_range)
+    if norm_range is not None:
+        norm_range = tuple(norm_range)
+
+    def hplc_graph(norm):
+        # renormalizing only changes Normalized, so Signal ignores it
+        if norm == "Normalized" and norm_range is not None:
+            exp.renormalize_hplc(norm_range, False)
+        return get_hplc_graphs(exp, view_range, x_ax, overlay, format_val, [norm])[0]
+
+    hplc_key = exp_key + (view_range, "mL" if overlay else x_ax, overlay)
+    return {
+        "Signal": cached_figure(
+            hplc_key + ("Signal", render_mode), lambda: hplc_graph("Signal")
+        ),
+        "Normalized": cached_figure(
+            hplc_key + ("Normalized", norm_range, render_mode),
+            lambda: hplc_graph("Normalized"),
+        ),
+    }
+
+
+def get_plotly(
+    exp,
+    view_range=None,
+    x_ax="mL",
+    format_val="png",
+    overlay=False,
+    norm_range=None,
+    exp_key=None,
+):
+    """
+    Graph components for an experiment. Figures are reused from
+    figure_cache when exp_key (the experiment ids and revisions) and the
+    options each figure depends on match. The download format only
+    changes the graph config, unless svg changes how traces are drawn.
+    """
     combined_graphs = {}
     html_graphs = []
+    if exp_key is None:
+        exp_key = (exp.id, exp.rev)
 
-    if exp.hplc is not None:
-        combined_graphs["Signal"], combined_graphs["Normalized"] = get_hplc_graphs(
-            exp, view_range, x_ax, overlay, format_val
+    if exp.compact_hplc is not None:
+        combined_graphs.update(
+            cached_hplc_figures(
+                exp, view_range, x_ax, format_val, overlay, norm_range, exp_key
+            )
         )
 
-    if exp.fplc is not None:
-        combined_graphs["FPLC"] = get_fplc_graphs(exp)
+    if exp.compact_fplc is not None:
+        render_mode = "svg" if format_val == "svg" else "auto"
+        combined_graphs["FPLC"] = cached_figure(
+            exp_key + ("FPLC", render_mode), lambda: get_fplc_graphs(exp, format_val)
+        )
 
     for data_type in combined_graphs.keys():
         html_graphs.extend(
@@ -245,6 +444,37 @@ def get_plotly(exp, view_range=None, x_ax="mL", format_val="png", overlay=False)
     return html_graphs
 
 
+def warm_experiment(id, rev):
+    """
+    Decodes a new or edited experiment and builds its default figures
+    before anyone opens it. Workers share the disk cache and claim each
+    revision, so only one of them does the work.
+    """
+    if not db.disk_cache.claim(f"warm {id} {rev}"):
+        return
+
+    try:
+        db.warm_experiment(id)
+        exp = get_view_experiments([id])
+        get_plotly(exp, exp_key=((id,), exp.rev))
+    except Exception as e:
+        logging.warning(f"Could not warm caches for {id}: {e}")
+
+
+# keep the experiment list current in the background, so page loads
+# don't have to list the database. Without a disk cache each worker would
+# warm every upload into memory only it can use, so uploads are only
+# warmed when there is one.
+if db.disk_cache is None:
+    db.watch_changes()
+else:
+    # warms one experiment at a time, away from the changes feed and requests
+    warm_pool = ThreadPoolExecutor(max_workers=1)
+    db.watch_changes(
+        on_change=lambda id, rev: warm_pool.submit(warm_experiment, id, rev)
+    )
+
+
 def parse_query(q_string):
     q_string = parse_qs(q_string.replace("?", ""))
 
@@ -328,7 +558,7 @@ def serve_layout():
                                 id="experiment_dropdown",
                                 options=[
                                     {"label": shorten_path_length(x), "value": x}
-                                    for x in db.update_experiment_list()
+                                    for x in db.experiment_ids
                                 ],
                                 multi=True,
                             )
@@ -478,21 +708,22 @@ def update_url(value):
     [
         Input("root-location", "pathname"),
         Input("root-location", "search"),
-        Input("x-ax-radios", "value"),
-        Input("renorm-hplc", "n_clicks"),
         Input("reset-norm", "n_clicks"),
         Input("reset-hplc", "n_clicks"),
-        Input("download-format-options", "value"),
-        Input("fplc-overlay", "value"),
+    ],
+    # the graphs are updated in place when these change, below
+    [
+        State("x-ax-radios", "value"),
+        State("download-format-options", "value"),
+        State("fplc-overlay", "value"),
     ],
 )
 def create_graphs(
     pathname,
     search_string,
-    radio_value,
-    renorm,
     reset_norm,
     reset,
+    radio_value,
     format_val,
     overlay_val,
 ):
@@ -506,24 +737,193 @@ def create_graphs(
 
         norm_range, view_range = parse_query(search_string)
 
-        if changed == "renorm-hplc.n_clicks":
-            norm_range = view_range
-
-        exp = get_experiments(experiment_name_list)
+        exp = get_view_experiments(
+            experiment_name_list, view_range, "mL" if overlay_val else radio_value
+        )
 
         # don't overlay if there is no HPLC data!
-        overlay = overlay_val and exp.hplc is not None
-
-        if norm_range is not None:
-            exp.renormalize_hplc(norm_range, False)
+        overlay = bool(overlay_val) and exp.compact_hplc is not None
 
         return (
-            get_plotly(exp, view_range, radio_value, format_val, overlay),
-            exp.hplc is None,
-            exp.fplc is None and not overlay,
+            get_plotly(
+                exp,
+                view_range,
+                radio_value,
+                format_val,
+                overlay,
+                norm_range,
+                experiment_key(experiment_name_list, exp),
+            ),
+            exp.compact_hplc is None,
+            exp.compact_fplc is None and not overlay,
         )
 
 
+def experiment_key(experiment_name_list, exp):
+    # what figures of these experiments are cached under
+    return (tuple(x.replace("%20", " ") for x in experiment_name_list), exp.rev)
+
+
+def relayout_range(relayout_data):
+    """
+    The x range a graph was zoomed or panned to, None if it was reset
+    to autorange, or False if the x axis didn't change.
+    """
+    if not relayout_data:
+        return False
+
+    for key, value in relayout_data.items():
+        axis, _, attribute = key.partition(".")
+        if not axis.startswith("xaxis"):
+            continue
+        if attribute == "range[0]":
+            return [value, relayout_data[f"{axis}.range[1]"]]
+        if attribute == "range":
+            return list(value)
+        if attribute == "autorange" and value:
+            return None
+
+    return False
+
+
+def resample_hplc_graph(
+    norm, relayout_data, pathname, search_string, x_ax, format_val, overlay_val
+):
+    view_range = relayout_range(relayout_data)
+    if view_range is False or not pathname:
+        raise dash.exceptions.PreventUpdate
+
+    norm_range, _ = parse_query(search_string)
+    exp = get_view_experiments(
+        exp_list_from_pathname(pathname), view_range, "mL" if overlay_val else x_ax
+    )
+    overlay = overlay_val and exp.compact_hplc is not None
+    if norm_range is not None:
+        exp.renormalize_hplc(norm_range, False)
+
+    return get_hplc_graphs(exp, view_range, x_ax, overlay, format_val, [norm])[0]
+
+
+resample_states = [
+    State("root-location", "pathname"),
+    State("root-location", "search"),
+    State("x-ax-radios", "value"),
+    State("download-format-options", "value"),
+    State("fplc-overlay", "value"),
+]
+
+# redraw the HPLC graphs from the stored experiment when they are zoomed,
+# so a zoomed-in peak gets every point while the overview stays light
+
+
+@app.callback(
+    Output("data-Signal", "figure"),
+    Input("data-Signal", "relayoutData"),
+    resample_states,
+    prevent_initial_call=True,
+)
+def resample_signal(relayout_data, *states):
+    return resample_hplc_graph("Signal", relayout_data, *states)
+
+
+@app.callback(
+    Output("data-Normalized", "figure"),
+    Input("data-Normalized", "relayoutData"),
+    resample_states,
+    prevent_initial_call=True,
+)
+def resample_normalized(relayout_data, *states):
+    return resample_hplc_graph("Normalized", relayout_data, *states)
+
+
+# Renormalizing happens in the browser, from the signal kept in the
+# Normalized graph's traces. refresh_xrange saves the range in the URL.
+app.clientside_callback(
+    ClientsideFunction(namespace="appia", function_name="renormalize"),
+    Output("data-Normalized", "figure", allow_duplicate=True),
+    Input("renorm-hplc", "n_clicks"),
+    State("root-location", "search"),
+    State("data-Normalized", "figure"),
+    prevent_initial_call=True,
+)
+
+# The x axis, overlay and download format switches change the graphs in
+# place (assets/graph_options.js) rather than rebuilding them. The overlay
+# also asks the server, for the preparative traces and options.
+for data_type in ["Signal", "Normalized"]:
+    app.clientside_callback(
+        ClientsideFunction(namespace="appia", function_name="setXAxis"),
+        Output(f"data-{data_type}", "figure", allow_duplicate=True),
+        Input("x-ax-radios", "value"),
+        Input("fplc-overlay", "value"),
+        State(f"data-{data_type}", "figure"),
+        prevent_initial_call=True,
+    )
+
+for data_type in ["Signal", "Normalized", "FPLC"]:
+    app.clientside_callback(
+        ClientsideFunction(namespace="appia", function_name="setRenderMode"),
+        Output(f"data-{data_type}", "figure", allow_duplicate=True),
+        Input("download-format-options", "value"),
+        State(f"data-{data_type}", "figure"),
+        prevent_initial_call=True,
+    )
+    app.clientside_callback(
+        ClientsideFunction(namespace="appia", function_name="setDownloadFormat"),
+        Output(f"data-{data_type}", "config"),
+        Input("download-format-options", "value"),
+        State(f"data-{data_type}", "config"),
+        prevent_initial_call=True,
+    )
+
+
+@app.callback(
+    Output("data-Signal", "figure", allow_duplicate=True),
+    Output("data-Normalized", "figure", allow_duplicate=True),
+    Output("fplc-options-sidebar", "hidden", allow_duplicate=True),
+    Input("fplc-overlay", "value"),
+    State("root-location", "pathname"),
+    State("root-location", "search"),
+    State("download-format-options", "value"),
+    prevent_initial_call=True,
+)
+def add_overlay(overlay_val, pathname, search_string, format_val):
+    """
+    Adds just the preparative traces to the HPLC graphs when the overlay
+    is turned on, and shows the preparative options with them. setXAxis
+    moves the analytic traces to mL, and takes these off again.
+    """
+    if not pathname:
+        raise dash.exceptions.PreventUpdate
+
+    experiment_name_list = exp_list_from_pathname(pathname)
+    _, view_range = parse_query(search_string)
+    # the overview create_graphs read first, so it comes from the cache
+    exp = get_experiments(experiment_name_list, view_level(web_trace_points))
+
+    overlay = bool(overlay_val) and exp.compact_hplc is not None
+    fplc_hidden = exp.compact_fplc is None and not overlay
+    if not overlay or exp.compact_fplc is None:
+        return dash.no_update, dash.no_update, fplc_hidden
+
+    render_mode = "svg" if format_val == "svg" else "auto"
+    if view_range is not None:
+        view_range = tuple(view_range)
+    traces = cached_figure(
+        experiment_key(experiment_name_list, exp)
+        + (view_range, "Preparative", render_mode),
+        lambda: preparative_traces(exp, view_range, format_val),
+    )
+
+    patches = []
+    for norm in ["Signal", "Normalized"]:
+        patch = dash.Patch()
+        patch["data"].extend(traces[norm])
+        patches.append(patch)
+
+    return (*patches, fplc_hidden)
+
+
 @app.callback(
     Output("root-location", "search"),
     [
@@ -548,6 +948,10 @@ def refresh_xrange(relayout_data, search_string, renorm, reset_norm, reset):
     if relayout_data == None or changed == "root-location.search":
         raise dash.exceptions.PreventUpdate
 
+    # nothing to renormalize to, and the browser left the graph alone too
+    if changed == "renorm-hplc.n_clicks" and view_range is None:
+        raise dash.exceptions.PreventUpdate
+
     try:
         data = [relayout_data["xaxis.range[0]"], relayout_data["xaxis.range[1]"]]
     except KeyError:
@@ -593,19 +997,20 @@ def download_csv(hplc_l, hplc_w, fplc, pathname, search_string):
         exp_list = exp_list_from_pathname(pathname)
         exp = get_experiments(exp_list)
 
-        if norm_range is not None:
+        # the wide table is Signal only, and is kept with the cached data
+        if norm_range is not None and changed != "download-hplc-wide.n_clicks":
             exp.renormalize_hplc(norm_range, False)
 
     if changed == "download-hplc-long.n_clicks":
-        if exp.hplc is not None:
+        if exp.compact_hplc is not None:
             return dcc.send_data_frame(exp.hplc.to_csv, "hplc-long.csv", index=False)
     elif changed == "download-hplc-wide.n_clicks":
-        if exp.hplc is not None:
+        if exp.compact_hplc is not None:
             return dcc.send_data_frame(exp.wide.to_csv, "hplc-wide.csv", index=False)
     elif changed == "download-fplc.n_clicks":
-        if exp.fplc is not None:
+        if exp.compact_fplc is not None:
             return dcc.send_data_frame(exp.fplc.to_csv, "fplc.csv", index=False)
 
 
 if __name__ == "__main__":
-    app.run_server(debug=os.environ.get("APPIA_DEBUG") == "Debug", port="8080")
+    app.run(debug=os.environ.get("APPIA_DEBUG") == "Debug", port="8080")